@@ -1,20 +1,17 @@
-from pypika import Order
-
 import frappe
 
+from inventory_management.inventory_management.stock_ledger import get_valuation_rates
+
+
 @frappe.whitelist()
 def fetch_rate_of_item(item_code, warehouse_id):
-    doctype = frappe.qb.DocType("Stock Ledger Entry")
     # fetch latest valuation_rate of item in warehouse
-    rate = (
-        frappe.qb.from_(doctype)
-        .select(doctype.valuation_rate)
-        .where(doctype.item == item_code)
-        .where(doctype.warehouse == warehouse_id)
-        .orderby(doctype.posting_date, order=Order.desc)
-        .limit(1)
-        .run(as_list=True)
-    )
-    if len(rate) > 0 and len(rate[0]) > 0:
-        return rate[0][0]
-    return 0
+    return get_valuation_rates([(item_code, warehouse_id)])[(item_code, warehouse_id)]
+
+
+@frappe.whitelist()
+def fetch_rates_of_items(pairs):
+    # fetch latest valuation_rate of many [item_code, warehouse_id] pairs in one call, in the same order
+    pairs = [tuple(pair) for pair in frappe.parse_json(pairs) or []]
+    rates = get_valuation_rates(pairs)
+    return [rates[pair] for pair in pairs]
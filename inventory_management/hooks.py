@@ -133,23 +133,17 @@ app_license = "mit"
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-#	"all": [
-#		"inventory_management.tasks.all"
-#	],
-#	"daily": [
-#		"inventory_management.tasks.daily"
-#	],
-#	"hourly": [
-#		"inventory_management.tasks.hourly"
-#	],
-#	"weekly": [
-#		"inventory_management.tasks.weekly"
-#	],
-#	"monthly": [
-#		"inventory_management.tasks.monthly"
-#	],
-# }
+scheduler_events = {
+	"all": [
+		"inventory_management.inventory_management.doctype.stock_repost_queue.stock_repost_queue.process_repost_queue"
+	],
+	"hourly": [
+		"inventory_management.inventory_management.doctype.stock_entry.stock_entry.fail_stale_background_submits"
+	],
+	"daily": [
+		"inventory_management.inventory_management.doctype.stock_repost_queue.stock_repost_queue.clear_completed_requests"
+	],
+}
 
 # Testing
 # -------
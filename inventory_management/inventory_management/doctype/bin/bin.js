@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Tanmoy Sarkar and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Bin", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,101 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from pypika.terms import Tuple
+
+
+class Bin(Document):
+	pass
+
+
+def on_doctype_update():
+	# one bin per (item, warehouse) pair
+	frappe.db.add_unique("Bin", ["item", "warehouse"], constraint_name="unique_item_warehouse")
+
+
+def get_bin_details(item: str, warehouse: str) -> dict:
+	# Fetch running qty, value and rate of item in warehouse, zero if nothing has been posted yet
+	return get_bins_details([(item, warehouse)])[(item, warehouse)]
+
+
+def get_bins_details(pairs: list) -> dict:
+	# Fetch the bins of many (item, warehouse) pairs with a single query, keyed by the pair
+	pairs = set(pairs)
+	bins = {pair: frappe._dict(name=None, actual_qty=0, stock_value=0, valuation_rate=0, fifo_queue=None)
+			for pair in pairs}
+	if not pairs:
+		return bins
+
+	doctype = frappe.qb.DocType("Bin")
+	rows = (frappe.qb.from_(doctype)
+			.select(doctype.name, doctype.item, doctype.warehouse, doctype.actual_qty, doctype.stock_value,
+					doctype.valuation_rate, doctype.fifo_queue)
+			.where(Tuple(doctype.item, doctype.warehouse).isin([Tuple(item, warehouse) for item, warehouse in pairs]))
+			.run(as_dict=True))
+	for row in rows:
+		bins[(row.item, row.warehouse)] = row
+	return bins
+
+
+def lock_bins(pairs: list) -> dict:
+	# Lock the bins of many (item, warehouse) pairs until the transaction ends and return their details keyed by
+	# the pair, read under the lock, bin name included so that updates need no lookup
+	# Rows are locked in (item, warehouse) order, so that two submits touching the same bins cannot deadlock,
+	# submits on other bins are not held up
+	pairs = sorted(set(pairs))
+	if not pairs:
+		return {}
+	# takes the locks, the read below only has to see the latest committed values
+	make_bins(pairs)
+
+	doctype = frappe.qb.DocType("Bin")
+	rows = (frappe.qb.from_(doctype)
+			.select(doctype.name, doctype.item, doctype.warehouse, doctype.actual_qty, doctype.stock_value,
+					doctype.valuation_rate, doctype.fifo_queue)
+			.where(Tuple(doctype.item, doctype.warehouse).isin([Tuple(item, warehouse) for item, warehouse in pairs]))
+			.orderby(doctype.item)
+			.orderby(doctype.warehouse)
+			.for_update()
+			.run(as_dict=True))
+	return {(row.item, row.warehouse): row for row in rows}
+
+
+def get_or_make_bin(item: str, warehouse: str) -> str:
+	bin_name = frappe.db.get_value("Bin", {"item": item, "warehouse": warehouse})
+	if not bin_name:
+		make_bins([(item, warehouse)])
+		bin_name = frappe.db.get_value("Bin", {"item": item, "warehouse": warehouse}, for_update=True)
+	return bin_name
+
+
+def make_bins(pairs: list):
+	# Make the missing bins of many (item, warehouse) pairs with one insert, existing ones are left as they are
+	# Every bin of pairs is locked exclusively until the transaction ends, in the order of pairs
+	# A duplicate key of INSERT IGNORE would only take a shared lock on a bin made concurrently, two first postings
+	# to a new bin would then deadlock upgrading theirs, ON DUPLICATE KEY UPDATE takes the exclusive one right away
+	doctype = frappe.qb.DocType("Bin")
+	now = frappe.utils.now()
+	(frappe.qb.into(doctype)
+	 .columns("name", "owner", "modified_by", "creation", "modified", "docstatus", "idx", "item", "warehouse",
+			  "actual_qty", "stock_value", "valuation_rate")
+	 .insert(*[(frappe.generate_hash(length=10), frappe.session.user, frappe.session.user, now, now, 0, 0, item,
+				warehouse, 0, 0, 0) for item, warehouse in pairs])
+	 .on_duplicate_key_update(doctype.item, doctype.item)
+	 .run())
+
+
+def update_bin(item: str, warehouse: str, qty_change: int, value_change: float, valuation_rate: float,
+			   fifo_queue: str, bin_name: str = None):
+	# Apply the effect of one ledger entry to the bin, in the caller's transaction
+	# bin_name saves looking the bin up when the caller has it already
+	bin_name = bin_name or get_or_make_bin(item, warehouse)
+	doctype = frappe.qb.DocType("Bin")
+	(frappe.qb.update(doctype)
+	 .set(doctype.actual_qty, doctype.actual_qty + qty_change)
+	 .set(doctype.stock_value, doctype.stock_value + value_change)
+	 .set(doctype.valuation_rate, valuation_rate)
+	 .set(doctype.fifo_queue, fifo_queue)
+	 .where(doctype.name == bin_name)
+	 .run())
@@ -0,0 +1,51 @@
+# Copyright (c) 2026, Tanmoy Sarkar and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from inventory_management.inventory_management.doctype.bin.bin import get_bin_details, lock_bins
+from inventory_management.inventory_management.doctype.item.test_item import create_item
+from inventory_management.inventory_management.doctype.stock_entry.test_stock_entry import new_stock_entry
+from inventory_management.inventory_management.doctype.stock_settings.test_stock_settings import update_valuation_method
+from inventory_management.inventory_management.doctype.warehouse.test_warehouse import create_warehouse
+
+
+class TestBin(FrappeTestCase):
+	def setUp(self):
+		update_valuation_method("FIFO")
+		self.warehouse = create_warehouse("Test Warehouse")
+		self.warehouse2 = create_warehouse("Test Warehouse 2")
+		self.item = create_item("Test Item", self.warehouse.name, 5, 500)
+
+	def test_bin_created_on_opening_stock(self):
+		bin_details = get_bin_details(self.item.name, self.warehouse.name)
+		self.assertTrue(bin_details.name, "Check if the bin has been created")
+		self.assertEqual(bin_details.actual_qty, 5)
+		self.assertEqual(bin_details.stock_value, 2500)
+		self.assertEqual(bin_details.valuation_rate, 500)
+
+	def test_bin_updated_on_submit_and_cancel(self):
+		stock_entry = new_stock_entry("Transfer", self.item.name, 2, self.warehouse.name, self.warehouse2.name, 500)
+		stock_entry.submit()
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse.name).actual_qty, 3)
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse2.name).actual_qty, 2)
+
+		stock_entry.cancel()
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse.name).actual_qty, 5)
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse2.name).actual_qty, 0)
+
+	def test_lock_bins_makes_missing_bins(self):
+		warehouse3 = create_warehouse("Test Warehouse 3")
+		pairs = [(self.item.name, self.warehouse.name), (self.item.name, self.warehouse2.name),
+				 (self.item.name, warehouse3.name)]
+		bins = lock_bins(pairs)
+
+		# Check if every pair has a bin, named so that it can be updated without a lookup
+		self.assertEqual(set(bins), set(pairs))
+		self.assertEqual(bins[pairs[0]].name, get_bin_details(*pairs[0]).name)
+		self.assertTrue(all(bins[pair].name for pair in pairs[1:]))
+		self.assertEqual(bins[pairs[2]].actual_qty, 0)
+
+		# Locking them again makes no more bins
+		lock_bins(pairs)
+		self.assertEqual(frappe.db.count("Bin", {"item": self.item.name}), 3)
@@ -11,12 +11,14 @@ class Item(Document):
 		self.code = self.name
 
 	def after_insert(self):
+		# Bulk import posts the opening stock of many items together
+		if self.flags.skip_opening_stock or not self.opening_qty:
+			return
 		# Create stock entry with type "Receive" with rate = opening valuation rate and qty = opening qty for opening stock
 		doc = frappe.new_doc("Stock Entry")
 		doc.date = datetime.now().date()
 		doc.time = datetime.now().time()
 		doc.type = "Receive"
-		doc.valuation_method = "Moving Average"
 		doc.append("items", {
 			"item": self.name,
 			"qty": self.opening_qty,
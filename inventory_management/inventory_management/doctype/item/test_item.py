@@ -1,8 +1,16 @@
 # Copyright (c) 2023, Tanmoy Sarkar and Contributors
 # See license.txt
 
+import csv
+import os
+import tempfile
+from unittest.mock import patch
+
 import frappe
 from frappe.tests.utils import FrappeTestCase
+from inventory_management.inventory_management.doctype.bin.bin import get_bin_details
+from inventory_management.inventory_management import item_import
+from inventory_management.inventory_management.item_import import import_items_from_file
 from inventory_management.inventory_management.doctype.warehouse.test_warehouse import create_warehouse
 
 def create_item(item_name, warehouse_name, qty, rate):
@@ -45,3 +53,71 @@ class TestItem(FrappeTestCase):
                                                                                  "correct in/out rate")
         self.assertEquals(ledger_entry.valuation_rate, item.opening_valuation_rate, "Check if the stock Ledger Entry "
                                                                                     "has correct valuation rate")
+
+    def test_create_item_without_opening_stock(self):
+        item = create_item("Test Item", self.warehouse.name, 0, 100)
+
+        # Check if no stock entry has been made for it
+        self.assertFalse(frappe.db.exists("Stock Ledger Entry", {"item": item.name}))
+
+    def test_import_items(self):
+        warehouse2 = create_warehouse("Test Warehouse 2")
+        rows = [
+            {"name1": "Imported Item 1", "opening_warehouse": self.warehouse.name, "opening_qty": 10,
+             "opening_valuation_rate": 100},
+            {"name1": "Imported Item 2", "opening_warehouse": self.warehouse.name, "opening_qty": 5,
+             "opening_valuation_rate": 200},
+            {"name1": "Imported Item 3", "opening_warehouse": warehouse2.name, "opening_qty": 0,
+             "opening_valuation_rate": 0},
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", delete=False) as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        self.addCleanup(os.remove, f.name)
+
+        # keep the import inside the test transaction
+        with patch.object(frappe.db, "commit"):
+            self.assertEqual(import_items_from_file(f.name), 3)
+
+        items = {item.name1: item.name for item in frappe.get_all("Item", filters={"name1": ["like", "Imported Item %"]},
+                                                                  fields=["name", "name1"])}
+        self.assertEqual(len(items), 3)
+
+        # Check if the opening stock of one warehouse has been posted by a single stock entry
+        stock_entries = {sl_entry.stock_entry for sl_entry in frappe.get_all(
+            "Stock Ledger Entry", filters={"item": ["in", list(items.values())]}, fields=["stock_entry"])}
+        self.assertEqual(len(stock_entries), 1)
+        self.assertEqual(get_bin_details(items["Imported Item 1"], self.warehouse.name).actual_qty, 10)
+        self.assertEqual(get_bin_details(items["Imported Item 2"], self.warehouse.name).stock_value, 1000)
+        self.assertEqual(get_bin_details(items["Imported Item 3"], warehouse2.name).actual_qty, 0)
+
+    def test_import_stops_at_bad_row(self):
+        rows = [
+            {"name1": "Imported Item 1", "opening_warehouse": self.warehouse.name, "opening_qty": 10,
+             "opening_valuation_rate": 100},
+            {"name1": "Imported Item 2", "opening_warehouse": self.warehouse.name, "opening_qty": 5,
+             "opening_valuation_rate": 200},
+            {"name1": "Imported Item 3", "opening_warehouse": self.warehouse.name, "opening_qty": -1,
+             "opening_valuation_rate": 100},
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", delete=False) as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        self.addCleanup(os.remove, f.name)
+
+        # bad row comes in the second chunk, keep the import inside the test transaction
+        with patch.object(item_import, "CHUNK_SIZE", 2), patch.object(frappe.db, "commit"), \
+                patch.object(frappe.db, "rollback"), patch.object(frappe, "publish_realtime") as publish_realtime:
+            self.assertRaises(frappe.ValidationError, import_items_from_file, f.name, "Administrator")
+
+        # Check if the user has been told where the import stopped
+        message = publish_realtime.call_args.args[1]
+        self.assertIn("Row 4", message)
+        self.assertIn("up to line 3", message)
+
+        # Check if the items of the first chunk came with their opening stock
+        items = frappe.get_all("Item", filters={"name1": ["like", "Imported Item %"]}, pluck="name")
+        self.assertEqual(len(items), 2)
+        self.assertEqual(sum(get_bin_details(item, self.warehouse.name).actual_qty for item in items), 15)
@@ -0,0 +1,119 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder import Order, functions as fn
+from frappe.utils import add_days, getdate, nowdate
+from pypika import Case
+from pypika import analytics as an
+
+
+class StockClosingEntry(Document):
+
+	def validate(self):
+		# only a period that is over can be closed
+		if getdate(self.period_end_date) >= getdate(nowdate()):
+			frappe.throw("Period end date must be before today")
+
+	def on_submit(self):
+		last_closing = get_last_closing()
+		if last_closing and getdate(self.period_end_date) <= getdate(last_closing.period_end_date):
+			frappe.throw("Stock is already closed up to {} by {}".format(last_closing.period_end_date,
+																		  last_closing.name))
+		# balances must not be taken from a ledger that is still being recomputed
+		if frappe.db.exists("Stock Repost Queue", {"status": ["in", ["Queued", "In Progress", "Failed"]],
+												   "posting_date": ["<=", self.period_end_date]}):
+			frappe.throw("Ledger entries on or before {} are waiting to be reposted, close the period once the "
+						 "Stock Repost Queue is done".format(self.period_end_date))
+		self.make_closing_balances(last_closing)
+
+	def on_cancel(self):
+		# a later closing is built on top of this one
+		later_closing = frappe.db.get_value("Stock Closing Entry", {"docstatus": 1,
+																	"period_end_date": [">", self.period_end_date]})
+		if later_closing:
+			frappe.throw("Cancel the later Stock Closing Entry {} first".format(later_closing))
+		frappe.db.delete("Stock Closing Balance", {"stock_closing_entry": self.name})
+
+	def make_closing_balances(self, last_closing=None):
+		# Balances of the previous closing plus the ledger entries posted since, written in one go
+		now = frappe.utils.now()
+		fields = ["name", "owner", "modified_by", "creation", "modified", "docstatus", "idx", "stock_closing_entry",
+				  "period_end_date", "item", "warehouse", "qty", "stock_value", "valuation_rate", "in_qty", "in_value",
+				  "out_qty", "out_value"]
+		rows = [[frappe.generate_hash(length=10), frappe.session.user, frappe.session.user, now, now, 0, 0,
+				 self.name, self.period_end_date, balance.item, balance.warehouse, balance.qty, balance.stock_value,
+				 balance.valuation_rate, balance.in_qty, balance.in_value, balance.out_qty, balance.out_value]
+				for balance in get_closing_balances(self.period_end_date, last_closing)]
+		frappe.db.bulk_insert("Stock Closing Balance", fields, rows)
+
+
+def get_last_closing(on_or_before=None) -> frappe._dict:
+	# Latest submitted closing, optionally the latest one not after the given date
+	filters = {"docstatus": 1}
+	if on_or_before:
+		filters["period_end_date"] = ["<=", on_or_before]
+	closing = frappe.get_all("Stock Closing Entry", filters=filters, fields=["name", "period_end_date"],
+							 order_by="period_end_date desc", limit=1)
+	return closing[0] if closing else None
+
+
+def validate_posting_date(posting_date):
+	# Nothing can be posted into a closed period, its balances are frozen in the closing snapshot
+	last_closing = get_last_closing()
+	if last_closing and getdate(posting_date) <= getdate(last_closing.period_end_date):
+		frappe.throw("Stock is closed up to {} by {}, cannot post on {}".format(
+			last_closing.period_end_date, last_closing.name, posting_date))
+
+
+def get_closing_balances(period_end_date, last_closing=None) -> list:
+	# Balance of every (item, warehouse) pair at the end of period_end_date
+	balances = {}
+	if last_closing:
+		for balance in frappe.get_all("Stock Closing Balance", filters={"stock_closing_entry": last_closing.name},
+									  fields=["item", "warehouse", "qty", "stock_value", "valuation_rate", "in_qty",
+											  "in_value", "out_qty", "out_value"]):
+			balances[(balance.item, balance.warehouse)] = balance
+
+	# Number the entries of every pair latest first, the running balances of row number 1 are the closing ones
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	entries = (frappe.qb.from_(doctype).select(
+		doctype.item,
+		doctype.warehouse,
+		doctype.qty_change,
+		doctype.in_out_rate,
+		doctype.qty_after_transaction,
+		doctype.stock_value_after_transaction,
+		doctype.valuation_rate,
+		an.RowNumber().over(doctype.item, doctype.warehouse)
+		.orderby(doctype.posting_datetime, doctype.name, order=Order.desc).as_('row_number')
+	).where(doctype.posting_datetime < add_days(period_end_date, 1)))
+	if last_closing:
+		entries = entries.where(doctype.posting_datetime >= add_days(last_closing.period_end_date, 1))
+
+	changes = (frappe.qb.from_(entries).select(
+		entries.item,
+		entries.warehouse,
+		fn.Sum(Case().when(entries.qty_change > 0, entries.qty_change).else_(0)).as_('in_qty'),
+		fn.Sum(Case().when(entries.qty_change > 0,
+						   entries.qty_change * entries.in_out_rate).else_(0)).as_('in_value'),
+		fn.Sum(Case().when(entries.qty_change < 0, entries.qty_change).else_(0)).as_('out_qty'),
+		fn.Sum(Case().when(entries.qty_change < 0,
+						   entries.qty_change * entries.in_out_rate).else_(0)).as_('out_value'),
+		fn.Max(Case().when(entries.row_number == 1, entries.qty_after_transaction)).as_('qty'),
+		fn.Max(Case().when(entries.row_number == 1, entries.stock_value_after_transaction)).as_('stock_value'),
+		fn.Max(Case().when(entries.row_number == 1, entries.valuation_rate)).as_('valuation_rate')
+	).groupby(entries.item, entries.warehouse).run(as_dict=True))
+
+	for change in changes:
+		balance = balances.setdefault((change.item, change.warehouse), frappe._dict(
+			item=change.item, warehouse=change.warehouse, in_qty=0, in_value=0, out_qty=0, out_value=0))
+		balance.in_qty += change.in_qty or 0
+		balance.in_value += change.in_value or 0
+		balance.out_qty += change.out_qty or 0
+		balance.out_value += change.out_value or 0
+		balance.qty = change.qty or 0
+		balance.stock_value = change.stock_value or 0
+		balance.valuation_rate = change.valuation_rate or 0
+	return list(balances.values())
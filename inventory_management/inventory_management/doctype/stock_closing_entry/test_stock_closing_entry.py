@@ -0,0 +1,81 @@
+# Copyright (c) 2026, Tanmoy Sarkar and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from inventory_management.inventory_management.doctype.item.test_item import create_item
+from inventory_management.inventory_management.doctype.stock_entry.test_stock_entry import new_stock_entry
+from inventory_management.inventory_management.doctype.stock_settings.test_stock_settings import update_valuation_method
+from inventory_management.inventory_management.doctype.warehouse.test_warehouse import create_warehouse
+from inventory_management.inventory_management.report.stock_balance.stock_balance import \
+	execute as stock_balance_execute
+
+
+def close_stock(period_end_date):
+	closing = frappe.get_doc({"doctype": "Stock Closing Entry", "period_end_date": period_end_date})
+	closing.insert()
+	closing.submit()
+	return closing
+
+
+class TestStockClosingEntry(FrappeTestCase):
+	def setUp(self):
+		update_valuation_method("FIFO")
+		self.warehouse = create_warehouse("Test Warehouse")
+		self.warehouse2 = create_warehouse("Test Warehouse 2")
+		self.item = create_item("Test Item", self.warehouse.name, 5, 500)
+		self.two_days_ago = frappe.utils.add_days(frappe.utils.nowdate(), -2)
+		self.yesterday = frappe.utils.add_days(frappe.utils.nowdate(), -1)
+
+	def test_closing_balances(self):
+		# Receive and consume in the second warehouse two days ago
+		for type, source_warehouse, target_warehouse, qty, rate in (
+				("Receive", "", self.warehouse2.name, 4, 200), ("Consume", self.warehouse2.name, "", 1, 200)):
+			stock_entry = new_stock_entry(type, self.item.name, qty, source_warehouse, target_warehouse, rate)
+			stock_entry.date = self.two_days_ago
+			stock_entry.save()
+			stock_entry.submit()
+
+		closing = close_stock(self.yesterday)
+
+		# Check if the snapshot holds the balance at the end of the period
+		balance = frappe.get_doc("Stock Closing Balance", {"stock_closing_entry": closing.name,
+														   "item": self.item.name, "warehouse": self.warehouse2.name})
+		self.assertEqual(balance.qty, 3)
+		self.assertEqual(balance.stock_value, 600)
+		self.assertEqual(balance.valuation_rate, 200)
+		self.assertEqual(balance.in_qty, 4)
+		self.assertEqual(balance.in_value, 800)
+		self.assertEqual(balance.out_qty, -1)
+		self.assertEqual(balance.out_value, -200)
+
+		# Stock balance report starts from the snapshot and adds the entries posted after it
+		new_stock_entry("Receive", self.item.name, 2, "", self.warehouse2.name, 500).submit()
+		report = stock_balance_execute(filters={"item": self.item.name, "warehouse": self.warehouse2.name})[1]
+		self.assertEqual(len(report), 1)
+		self.assertEqual(report[0].balance_qty, 5)
+		self.assertEqual(report[0].balance_value, 1600)
+		self.assertEqual(report[0].in_qty, 6)
+		self.assertEqual(report[0].out_qty, -1)
+		self.assertEqual(report[0].latest_valuation_rate, 320)  # FIFO > (200 * 3 + 500 * 2) / 5
+
+		# Report as of the closing date comes from the snapshot alone
+		report = stock_balance_execute(filters={"item": self.item.name, "warehouse": self.warehouse2.name,
+												"to_date": self.yesterday})[1]
+		self.assertEqual(report[0].balance_qty, 3)
+		self.assertEqual(report[0].latest_valuation_rate, 200)
+
+		# Cancelling the closing drops its snapshot
+		closing.cancel()
+		self.assertFalse(frappe.db.exists("Stock Closing Balance", {"stock_closing_entry": closing.name}))
+
+	def test_posting_in_closed_period(self):
+		closing = close_stock(self.yesterday)
+
+		stock_entry = new_stock_entry("Receive", self.item.name, 1, "", self.warehouse.name, 500)
+		stock_entry.date = self.yesterday
+		self.assertRaises(frappe.exceptions.ValidationError, stock_entry.save)
+
+		# Period cannot be closed twice
+		self.assertRaises(frappe.exceptions.ValidationError, close_stock, self.two_days_ago)
+		closing.cancel()
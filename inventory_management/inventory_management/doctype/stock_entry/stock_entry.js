@@ -9,6 +9,11 @@ frappe.ui.form.on('Stock Entry', {
     },
     refresh: (frm) => {
         update_on_change_type(frm);
+        if(frm.doc.submission_status === "Queued" || frm.doc.submission_status === "Processing"){
+            frm.set_intro("This Stock Entry is being submitted in the background", "blue");
+        } else if(frm.doc.submission_status === "Failed"){
+            frm.set_intro("Submitting in the background failed, see Submission Error", "red");
+        }
         if(frm.doc.docstatus === 1 || frm.doc.docstatus === 2){
             frm.add_custom_button("Stock Ledger Report", function(){
                 frappe.set_route("query-report", "Stock Ledger", {"stock_entry": frm.doc.name});
@@ -57,6 +62,10 @@ function update_on_change_type(frm){
     }
 }
 
+// rows waiting for their rate, fetched together once the edits settle
+let pending_rate_rows = {};
+let pending_rate_timeout = null;
+
 function fetch_item_rate(cdt, cdn){
     let row = frappe.get_doc(cdt, cdn);
     const item_code = row.item;
@@ -64,29 +73,48 @@ function fetch_item_rate(cdt, cdn){
     const source_warehouse = row.source_warehouse;
     const type = cur_frm.fields_dict.type.value;
     if(item_code && type === "Consume" && source_warehouse){
-        fetch_item_rate_helper(item_code, source_warehouse, cdt, cdn)
+        queue_item_rate_fetch(item_code, source_warehouse, cdt, cdn)
     }
     if(item_code && type === "Receive" && target_warehouse){
-        fetch_item_rate_helper(item_code, target_warehouse, cdt, cdn)
+        queue_item_rate_fetch(item_code, target_warehouse, cdt, cdn)
     }
     if(item_code && type === "Transfer" && target_warehouse && source_warehouse){
-        fetch_item_rate_helper(item_code, source_warehouse, cdt, cdn)
+        queue_item_rate_fetch(item_code, source_warehouse, cdt, cdn)
     }
 }
 
-async function fetch_item_rate_helper(item_code, warehouse, cdt, cdn){
+function queue_item_rate_fetch(item_code, warehouse, cdt, cdn){
+    // later changes of the same row replace the earlier ones
+    pending_rate_rows[cdn] = {item_code: item_code, warehouse: warehouse, cdt: cdt};
+    clearTimeout(pending_rate_timeout);
+    pending_rate_timeout = setTimeout(fetch_item_rates_helper, 300);
+}
+
+function fetch_item_rates_helper(){
+    const rows = pending_rate_rows;
+    pending_rate_rows = {};
+    const cdns = Object.keys(rows);
+    if(!cdns.length){
+        return;
+    }
     frappe.call({
-        method: "inventory_management.helpers.fetch_rate_of_item",
+        method: "inventory_management.helpers.fetch_rates_of_items",
         args: {
-            item_code: item_code,
-            warehouse_id: warehouse
+            pairs: cdns.map((cdn) => [rows[cdn].item_code, rows[cdn].warehouse])
         },
         callback: function (r) {
-            frappe.get_doc(cdt, cdn).rate = r.message
-            if (r.message === 0) {
-                cur_frm.fields_dict.items.grid.toggle_enable("rate", true)
-            }
+            cdns.forEach((cdn, index) => {
+                const row = frappe.get_doc(rows[cdn].cdt, cdn);
+                // row may have been removed meanwhile
+                if (!row) {
+                    return;
+                }
+                row.rate = r.message[index]
+                if (r.message[index] === 0) {
+                    cur_frm.fields_dict.items.grid.toggle_enable("rate", true)
+                }
+            });
             cur_frm.refresh_field("items")
         }
     });
-}
\ No newline at end of file
+}
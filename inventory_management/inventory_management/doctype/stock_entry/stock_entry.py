@@ -2,14 +2,83 @@
 # For license information, please see license.txt
 
 # import frappe
+from collections import defaultdict
+
 from frappe.model.document import Document
-from frappe.query_builder import functions as fn
+from pypika.terms import Tuple
 import frappe
 
+from inventory_management.inventory_management.doctype.bin.bin import get_bin_details, get_bins_details
+from inventory_management.inventory_management.doctype.stock_closing_entry.stock_closing_entry import \
+    validate_posting_date
+from inventory_management.inventory_management.doctype.stock_ledger_entry.stock_ledger_entry import \
+    get_posting_datetime
+from inventory_management.inventory_management.doctype.stock_repost_queue.stock_repost_queue import queue_repost
+from inventory_management.inventory_management.stock_ledger import make_sl_entries, make_time_ordered_names, \
+    uses_time_ordered_names
+from inventory_management.inventory_management.valuation import ValuationContext, get_transfer_rate, \
+    value_stock_change
+
+# lines posted at a time on submit, progress of a background submit is published after each chunk
+SUBMIT_CHUNK_SIZE = 500
+# seconds a background submit may run, its worker is killed after that
+SUBMIT_JOB_TIMEOUT = 3600
+
 
 class StockEntry(Document):
 
+    def autoname(self):
+        # without a name set here, the SE{#####} series of the doctype names it
+        if uses_time_ordered_names():
+            self.name = make_time_ordered_names(1, "SE")[0]
+
+    def insert(self, *args, **kwargs):
+        # A new entry inserted with docstatus 1, e.g. through the REST API, is submitted without save
+        if self.docstatus == 1 and self.should_submit_in_background():
+            self.queue_submit()
+            return self
+        return super().insert(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        # An existing draft is submitted through here with docstatus 1, by submit() as well as by the desk form
+        # saving the document as submitted
+        # Entries with more lines than set in Stock Settings are submitted by a background job, posting them
+        # within the web request would outlast its timeout
+        if self.docstatus == 1 and self.should_submit_in_background():
+            self.queue_submit()
+            return self
+        return super().save(*args, **kwargs)
+
+    def should_submit_in_background(self):
+        if self.flags.in_background_submit or self.flags.in_bulk_posting or self.flags.in_item_import:
+            return False
+        threshold = frappe.utils.cint(frappe.db.get_single_value("Stock Settings", "background_submit_threshold"))
+        if not threshold or len(self.items) <= threshold:
+            return False
+        # only the submit itself, not updates of an entry already submitted
+        return self.is_new() or frappe.db.get_value("Stock Entry", self.name, "docstatus") == 0
+
+    def queue_submit(self):
+        self.docstatus = 0
+        # another request may be queueing it at the same time
+        if not self.is_new() and frappe.db.get_value("Stock Entry", self.name, "submission_status",
+                                                     for_update=True) in ("Queued", "Processing"):
+            frappe.throw("Stock Entry {} is already queued for submission".format(self.name))
+        # the job submits the draft as saved here, validated right away
+        self.save()
+        self.check_permission("submit")
+        # modified changes too, so that a stale form can't save the draft while it is queued
+        self.db_set({"submission_status": "Queued", "submission_error": None}, notify=True)
+        frappe.enqueue("inventory_management.inventory_management.doctype.stock_entry.stock_entry"
+                       ".submit_in_background", queue="long", timeout=SUBMIT_JOB_TIMEOUT, enqueue_after_commit=True,
+                       now=frappe.flags.in_test, stock_entry=self.name)
+        frappe.msgprint("Stock Entry {} has {} lines, it will be submitted in the background".format(
+            self.name, len(self.items)))
+
     def validate(self):
+        # the background job submits the draft as it was queued
+        if self.submission_status in ("Queued", "Processing") and not self.flags.in_background_submit:
+            frappe.throw("Stock Entry {} is queued for submission and cannot be changed".format(self.name))
         # check if date and time is not in future
 
         if frappe.utils.getdate(self.date) > frappe.utils.getdate(frappe.utils.nowdate()):
@@ -17,6 +86,8 @@ class StockEntry(Document):
         if frappe.utils.getdate(self.date) == frappe.utils.getdate(frappe.utils.nowdate()) and frappe.utils.get_time(
                 self.time) > frappe.utils.get_time(frappe.utils.nowtime()):
             frappe.throw("Time cannot be in future")
+        # check if the period is not closed
+        validate_posting_date(self.date)
         # check if there is any duplicate entry in items
         checked_items = set()  # <item_code>__<source_warehouse>__<target_warehouse>
         for item_transaction in self.items:
@@ -30,26 +101,35 @@ class StockEntry(Document):
             checked_items.add(key)
 
         # check if there is enough stock in source warehouse to transfer or consume
+        # Fetch available qty of every pair with a single query, checked again under the bin locks on submit
         if self.type == "Transfer" or self.type == "Consume":
-            for item_transaction in self.items:
-                item = item_transaction.item
-                warehouse = item_transaction.source_warehouse
-                qty = item_transaction.qty
-                # Fetch total qty of item in warehouse
-                doctype = frappe.qb.DocType("Stock Ledger Entry")
-                total_qty = (frappe.qb.from_(doctype)
-                             .select(fn.Sum(doctype.qty_change))
-                             .where(doctype.item == item)
-                             .where(doctype.warehouse == warehouse)
-                             .groupby(doctype.item, doctype.warehouse)
-                             .run(as_list=True))
-                if len(total_qty) > 0 and len(total_qty[0]) > 0:
-                    total_qty = total_qty[0][0]
-                else:
-                    total_qty = 0
-                # If total qty is less than qty to be transferred or consumed, throw error
-                if total_qty < qty:
-                    frappe.throw("Not enough stock of item {} available in warehouse {}".format(item, warehouse))
+            self.validate_stock_availability(get_bins_details(self.get_bin_pairs()))
+
+    def validate_stock_availability(self, bins):
+        if self.type != "Transfer" and self.type != "Consume":
+            return
+        # Sum the requested qty per (item, source warehouse), same pair can appear on several lines
+        requested_qty = defaultdict(int)
+        for item_transaction in self.items:
+            requested_qty[(item_transaction.item, item_transaction.source_warehouse)] += item_transaction.qty or 0
+        # Collect every shortfall so that all of them are reported together
+        shortfalls = []
+        for (item, warehouse), qty in requested_qty.items():
+            total_qty = bins[(item, warehouse)].actual_qty if (item, warehouse) in bins else 0
+            if total_qty < qty:
+                shortfalls.append("Not enough stock of item {} available in warehouse {} (required {}, available {})"
+                                  .format(item, warehouse, qty, total_qty))
+        if shortfalls:
+            frappe.throw("<br>".join(shortfalls))
+
+    def get_bin_pairs(self):
+        # (item, warehouse) pairs of every bin this entry posts to
+        pairs = []
+        for item_transaction in self.items:
+            for warehouse in (item_transaction.source_warehouse, item_transaction.target_warehouse):
+                if warehouse and (item_transaction.item, warehouse) not in pairs:
+                    pairs.append((item_transaction.item, warehouse))
+        return pairs
 
     def before_save(self):
         # 	Make sure qty is not negative or zero and rate is not negative or zero
@@ -60,110 +140,179 @@ class StockEntry(Document):
                 frappe.throw("Quantity must be greater than zero, Remove the item or set the quantity")
 
     def on_submit(self):
+        # Lock the bins this entry touches, concurrent submits on the same bins wait here until this one commits
+        # Availability was checked in validate without the lock, check it again against the locked bins
+        valuation_context = ValuationContext(self.get_bin_pairs(), for_update=True)
+        self.validate_stock_availability(valuation_context.bins)
         # Create stock ledger entries
-        self.create_stock_ledger_entries()
+        self.create_stock_ledger_entries(valuation_context)
 
-    def create_stock_ledger_entries(self, is_cancel=False):
-        valuation_method = frappe.get_doc("Stock Settings").valuation_method
-        for item_transaction in self.items:
+    def create_stock_ledger_entries(self, valuation_context):
+        # Compute the ledger entries of this stock entry in memory and write them chunk by chunk of lines,
+        # all of them within the submit transaction
+        sl_entries = []
+        for start in range(0, len(self.items), SUBMIT_CHUNK_SIZE):
+            chunk = self._get_sl_entries(valuation_context, self.items[start:start + SUBMIT_CHUNK_SIZE])
+            make_sl_entries(chunk)
+            sl_entries.extend(chunk)
+            if self.flags.in_background_submit:
+                posted = min(start + SUBMIT_CHUNK_SIZE, len(self.items))
+                frappe.publish_progress(posted * 100 / len(self.items), title="Submitting {}".format(self.name),
+                                        doctype=self.doctype, docname=self.name,
+                                        description="{} of {} lines posted".format(posted, len(self.items)))
+        valuation_context.flush()
+        self._queue_repost_for_backdated_entries(sl_entries)
+
+    def _get_sl_entries(self, valuation_context, item_transactions):
+        sl_entries = []
+        for item_transaction in item_transactions:
             if self.type == "Transfer":
-                # Insert ledger entry for source warehouse
-                doc = frappe.new_doc("Stock Ledger Entry")
-                doc.item = item_transaction.item
-                doc.warehouse = item_transaction.source_warehouse
-                doc.qty_change = -item_transaction.qty
-                doc.in_out_rate = item_transaction.rate
-                doc.valuation_rate = self._calculate_valuation_of_item(item_transaction, True)
-                doc.posting_date = self.date if not is_cancel else frappe.utils.nowdate()
-                doc.posting_time = self.time if not is_cancel else frappe.utils.nowtime()
-                doc.stock_entry = self.name
-                doc.insert()
-                #  Insert ledger entry for target warehouse
-                doc = frappe.new_doc("Stock Ledger Entry")
-                doc.item = item_transaction.item
-                doc.warehouse = item_transaction.target_warehouse
-                doc.qty_change = item_transaction.qty
-                doc.in_out_rate = item_transaction.rate
-                doc.valuation_rate = self._calculate_valuation_of_item(item_transaction)
-                doc.posting_date = self.date if not is_cancel else frappe.utils.nowdate()
-                doc.posting_time = self.time if not is_cancel else frappe.utils.nowtime()
-                doc.stock_entry = self.name
-                doc.insert()
+                # Ledger entry for source warehouse
+                source_sl_entry = self._get_sl_entry(valuation_context, item_transaction.item,
+                                                     item_transaction.source_warehouse,
+                                                     -item_transaction.qty, item_transaction.rate, True)
+                # Stock arrives in the target warehouse at the cost it left the source at, so that moving it
+                # does not change the total stock value
+                transfer_rate = get_transfer_rate(source_sl_entry["stock_value_difference"], item_transaction.qty)
+                source_sl_entry["in_out_rate"] = transfer_rate
+                sl_entries.append(source_sl_entry)
+                # Ledger entry for target warehouse
+                sl_entries.append(self._get_sl_entry(valuation_context, item_transaction.item,
+                                                     item_transaction.target_warehouse,
+                                                     item_transaction.qty, transfer_rate, False))
             else:
-                valuation = self._calculate_valuation_of_item(item_transaction, self.type == "Consume")
-                doc = frappe.new_doc("Stock Ledger Entry")
-                doc.item = item_transaction.item
-                doc.warehouse = item_transaction.target_warehouse or item_transaction.source_warehouse
-                doc.qty_change = -item_transaction.qty if self.type == "Consume" else item_transaction.qty
-                doc.in_out_rate = item_transaction.rate
-                doc.valuation_rate = valuation
-                doc.posting_date = self.date if not is_cancel else frappe.utils.nowdate()
-                doc.posting_time = self.time if not is_cancel else frappe.utils.nowtime()
-                doc.stock_entry = self.name
-                doc.insert()
+                is_consumed = self.type == "Consume"
+                sl_entries.append(self._get_sl_entry(valuation_context, item_transaction.item,
+                                                     item_transaction.target_warehouse or item_transaction.source_warehouse,
+                                                     -item_transaction.qty if is_consumed else item_transaction.qty,
+                                                     item_transaction.rate, is_consumed))
+        return sl_entries
+
+    def _get_sl_entry(self, valuation_context, item, warehouse, qty_change, in_out_rate, is_consumed):
+        # Value the entry against the bin of item in warehouse, later lines of the same bin see its effect
+        valuation = valuation_context.apply(item, warehouse, qty_change, in_out_rate, is_consumed)
+        return {
+            "item": item,
+            "warehouse": warehouse,
+            "qty_change": qty_change,
+            "in_out_rate": in_out_rate,
+            "valuation_rate": valuation.valuation_rate,
+            "stock_value_difference": valuation.value_change,
+            "qty_after_transaction": valuation.qty_after_transaction,
+            "stock_value_after_transaction": valuation.stock_value_after_transaction,
+            "fifo_queue": valuation.fifo_queue,
+            "posting_date": self.date,
+            "posting_time": self.time,
+            "stock_entry": self.name
+        }
+
+    def _queue_repost_for_backdated_entries(self, sl_entries):
+        # Entries posted before existing ledger entries of the same bin leave later valuations stale,
+        # queue those bins for a repost from this posting on
+        if not sl_entries:
+            return
+        posting_date, posting_time = sl_entries[0]["posting_date"], sl_entries[0]["posting_time"]
+        pairs = {(sl_entry["item"], sl_entry["warehouse"]) for sl_entry in sl_entries}
+        doctype = frappe.qb.DocType("Stock Ledger Entry")
+        later_bins = (frappe.qb.from_(doctype)
+                      .select(doctype.item, doctype.warehouse)
+                      .distinct()
+                      .where(Tuple(doctype.item, doctype.warehouse).isin([Tuple(*pair) for pair in pairs]))
+                      .where(doctype.posting_datetime > get_posting_datetime(posting_date, posting_time))
+                      .run())
+        for item, warehouse in later_bins:
+            queue_repost(item, warehouse, posting_date, posting_time)
 
     def on_cancel(self):
-        for item_transaction in self.items:
-            item_transaction.reverse_transaction()
-        # reverse type of stock entry if it's consume or receive
-        if self.type == "Consume":
-            self.type = "Receive"
-        elif self.type == "Receive":
-            self.type = "Consume"
-        # Create reverse stock ledger entries
-        self.create_stock_ledger_entries(is_cancel=True)
-        ### Roll back the changes
-        # reverse type of stock entry if it's consume or receive
-        if self.type == "Consume":
-            self.type = "Receive"
-        elif self.type == "Receive":
-            self.type = "Consume"
-        # reverse item transactions
-        for item_transaction in self.items:
-            item_transaction.reverse_transaction()
+        # Post the exact negation of every ledger entry written for this stock entry, read back from the ledger,
+        # so that cancelling costs only this entry's own rows and leaves the items untouched
+        sl_entry_doctype = frappe.qb.DocType("Stock Ledger Entry")
+        submitted_entries = (frappe.qb.from_(sl_entry_doctype)
+                             .select(sl_entry_doctype.name, sl_entry_doctype.item, sl_entry_doctype.warehouse,
+                                     sl_entry_doctype.qty_change, sl_entry_doctype.in_out_rate,
+                                     sl_entry_doctype.stock_value_difference)
+                             .where(sl_entry_doctype.stock_entry == self.name)
+                             .where(sl_entry_doctype.is_cancelled == 0)
+                             .orderby(sl_entry_doctype.posting_datetime)
+                             .orderby(sl_entry_doctype.name)
+                             .run(as_dict=True))
+        if not submitted_entries:
+            return
 
-    # Private method
-    # If received, make qty_change positive, else negative
-    def _calculate_valuation_of_item(self, item_transaction, is_consumed=False):
-        item = item_transaction.item
-        if is_consumed:
-            warehouse = item_transaction.source_warehouse
-        else:
-            warehouse = item_transaction.target_warehouse
-        incoming_rate = item_transaction.rate
-        incoming_qty = item_transaction.qty
-        if is_consumed:
-            incoming_qty = -incoming_qty
+        valuation_context = ValuationContext([(sl_entry.item, sl_entry.warehouse) for sl_entry in submitted_entries],
+                                             for_update=True)
+        posting_date, posting_time = frappe.utils.nowdate(), frappe.utils.nowtime()
+        sl_entries = []
+        # undo the latest entry first
+        for sl_entry in reversed(submitted_entries):
+            valuation = valuation_context.reverse(sl_entry.item, sl_entry.warehouse, sl_entry.qty_change,
+                                                  sl_entry.stock_value_difference or 0, sl_entry.in_out_rate)
+            sl_entries.append({
+                "item": sl_entry.item,
+                "warehouse": sl_entry.warehouse,
+                "qty_change": -sl_entry.qty_change,
+                "in_out_rate": sl_entry.in_out_rate,
+                "valuation_rate": valuation.valuation_rate,
+                "stock_value_difference": valuation.value_change,
+                "qty_after_transaction": valuation.qty_after_transaction,
+                "stock_value_after_transaction": valuation.stock_value_after_transaction,
+                "fifo_queue": valuation.fifo_queue,
+                "posting_date": posting_date,
+                "posting_time": posting_time,
+                "stock_entry": self.name,
+                "is_cancelled": 1,
+                "reversal_of": sl_entry.name
+            })
+        make_sl_entries(sl_entries)
+        valuation_context.flush()
+        (frappe.qb.update(sl_entry_doctype)
+         .set(sl_entry_doctype.is_cancelled, 1)
+         .where(sl_entry_doctype.name.isin([sl_entry.name for sl_entry in submitted_entries]))
+         .run())
 
-        return calculate_valuation(item, warehouse, incoming_qty, incoming_rate, is_consumed)
+
+def submit_in_background(stock_entry: str):
+    # Background job of StockEntry.queue_submit, the whole submit is one transaction, rolled back on failure
+    # with the error kept on the entry
+    if frappe.db.get_value("Stock Entry", stock_entry, "submission_status", for_update=True) != "Queued":
+        frappe.db.commit()
+        return
+    doc = frappe.get_doc("Stock Entry", stock_entry)
+    doc.db_set("submission_status", "Processing", notify=True)
+    frappe.db.commit()
+
+    try:
+        # cleared by the submit itself
+        doc.submission_status = None
+        doc.flags.in_background_submit = True
+        doc.submit()
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        frappe.get_doc("Stock Entry", stock_entry).db_set({"submission_status": "Failed",
+                                                           "submission_error": frappe.get_traceback()}, notify=True)
+        frappe.db.commit()
+
+
+def fail_stale_background_submits():
+    # A worker killed by the job timeout, running out of memory or restarted never gets to mark its entry Failed,
+    # the entry would be left Processing and could neither be changed nor queued again
+    stale_before = frappe.utils.add_to_date(frappe.utils.now_datetime(), seconds=-SUBMIT_JOB_TIMEOUT)
+    for stock_entry in frappe.get_all("Stock Entry", filters={"docstatus": 0, "submission_status": "Processing",
+                                                              "modified": ["<", stale_before]}, pluck="name"):
+        frappe.get_doc("Stock Entry", stock_entry).db_set({
+            "submission_status": "Failed",
+            "submission_error": "The background submit was stopped before it finished, submit the entry again"
+        }, notify=True)
+        frappe.db.commit()
 
 
 def calculate_valuation(item: str, warehouse: str, incoming_qty: int = 0, incoming_rate: int = 0, is_consumed: bool = False):
-    valuation_rate = 0
-    valuation_method = frappe.get_doc("Stock Settings").valuation_method
-    doctype = frappe.qb.DocType("Stock Ledger Entry")
-    if valuation_method == "FIFO":
-        rate = (frappe.qb.from_(doctype)
-                .select((fn.Sum(doctype.qty_change * doctype.in_out_rate) + incoming_rate * incoming_qty) / (
-                fn.Sum(doctype.qty_change) + incoming_qty))
-                .where(doctype.item == item)
-                .where(doctype.warehouse == warehouse)
-                .groupby(doctype.item, doctype.warehouse)
-                .run(as_list=True))
-        if len(rate) > 0 and len(rate[0]) > 0 and rate[0][0] is not None:
-            valuation_rate = max(rate[0][0], 0)
-    elif valuation_method == "Moving Average":
-        rate = (frappe.qb.from_(doctype)
-                .select(
-            (fn.Sum(doctype.qty_change) * fn.Avg(doctype.in_out_rate) + incoming_qty * incoming_rate) / (
-                    fn.Sum(doctype.qty_change) + incoming_qty))
-                .where(doctype.item == item)
-                .where(doctype.warehouse == warehouse)
-                .groupby(doctype.item, doctype.warehouse)
-                .run(as_list=True))
-        if len(rate) > 0 and len(rate[0]) > 0 and rate[0][0] is not None:
-            valuation_rate = rate[0][0]
-
-    if valuation_rate == 0:
-        valuation_rate = 0 if is_consumed else incoming_rate
-    return valuation_rate
+    return get_valuation(item, warehouse, incoming_qty, incoming_rate, is_consumed).valuation_rate
+
+
+# If received, incoming_qty is positive, else negative
+def get_valuation(item: str, warehouse: str, incoming_qty: int = 0, incoming_rate: int = 0, is_consumed: bool = False):
+    valuation_method = frappe.db.get_single_value("Stock Settings", "valuation_method")
+    return value_stock_change(get_bin_details(item, warehouse), incoming_qty, incoming_rate, valuation_method,
+                              is_consumed)
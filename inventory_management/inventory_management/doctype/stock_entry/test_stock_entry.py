@@ -1,15 +1,25 @@
 # Copyright (c) 2023, Tanmoy Sarkar and Contributors
 # See license.txt
 import datetime
+import json
 import math
+import multiprocessing
+import time
 from datetime import timedelta
+from unittest.mock import patch
 
 import frappe
+from frappe.desk.form.save import savedocs
 from frappe.tests.utils import FrappeTestCase
+from inventory_management.inventory_management.doctype.bin.bin import get_bin_details, lock_bins
 from inventory_management.inventory_management.doctype.item.test_item import create_item
 from inventory_management.inventory_management.doctype.warehouse.test_warehouse import create_warehouse
 from inventory_management.inventory_management.doctype.stock_settings.test_stock_settings import update_valuation_method
-from inventory_management.inventory_management.doctype.stock_entry.stock_entry import calculate_valuation
+from inventory_management.inventory_management.doctype.stock_entry.stock_entry import calculate_valuation, \
+	fail_stale_background_submits
+from inventory_management.inventory_management import stock_posting
+from inventory_management.inventory_management.stock_posting import post_stock_entries
+from inventory_management.inventory_management.valuation import value_stock_change
 
 
 def add_minutes(time: datetime.time, minutes: int) -> datetime.time:
@@ -32,6 +42,23 @@ def new_stock_entry(type: str, item: str, qty: int, source_warehouse: str, targe
 	return stock_entry
 
 
+def submit_stock_entry_in_new_process(site: str, sites_path: str, type: str, item: str, qty: int,
+									  source_warehouse: str, target_warehouse: str, rate: int) -> bool:
+	# Runs in its own process with its own database connection, returns whether the entry got submitted
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	frappe.set_user("Administrator")
+	try:
+		new_stock_entry(type, item, qty, source_warehouse, target_warehouse, rate).submit()
+		frappe.db.commit()
+		return True
+	except frappe.ValidationError:
+		frappe.db.rollback()
+		return False
+	finally:
+		frappe.destroy()
+
+
 class TestStockEntry(FrappeTestCase):
 	def setUp(self):
 		update_valuation_method("FIFO")
@@ -69,6 +96,36 @@ class TestStockEntry(FrappeTestCase):
 		self.assertRaises(frappe.exceptions.ValidationError, stock_entry.save,
 						  "Check if validation failed for setting a time in the future")
 
+	def test_validation_sums_qty_of_repeated_item_and_warehouse(self):
+		warehouse3 = create_warehouse("Test Warehouse 3")
+		# Each line fits in the available stock of 5, but together they don't
+		stock_entry = frappe.new_doc("Stock Entry")
+		stock_entry.type = "Transfer"
+		stock_entry.date = frappe.utils.nowdate()
+		stock_entry.time = frappe.utils.nowtime()
+		for target_warehouse in (self.warehouse2.name, warehouse3.name):
+			stock_entry.append("items", {
+				"item": self.item.name,
+				"qty": 3,
+				"source_warehouse": self.warehouse.name,
+				"target_warehouse": target_warehouse,
+				"rate": 500
+			})
+		self.assertRaises(frappe.exceptions.ValidationError, stock_entry.save,
+						  "Check if validation failed for transferring more than available quantity in total")
+
+		# Check if validation passes once the total fits in the available stock
+		stock_entry.items[1].qty = 2
+		stock_entry.save()
+
+		# Second line of the source bin is valued after the first one
+		stock_entry.submit()
+		source_entries = frappe.get_all("Stock Ledger Entry", filters={"stock_entry": stock_entry.name,
+																	   "warehouse": self.warehouse.name},
+										fields=["qty_after_transaction"], order_by="name")
+		self.assertEqual([entry.qty_after_transaction for entry in source_entries], [2, 0])
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse.name).actual_qty, 0)
+
 	def test_submit_for_consuming_items(self):
 		# Create a new stock entry
 		stock_entry = new_stock_entry("Consume", self.item.name, 2, self.warehouse.name, "", 500)
@@ -155,6 +212,23 @@ class TestStockEntry(FrappeTestCase):
 		valuation = calculate_valuation(self.item.name, self.warehouse2.name)
 		self.assertEquals(ledger_entry.valuation_rate, valuation, "Check if the stock ledger entry has ")
 
+	def test_transfer_carries_source_cost(self):
+		new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 1000).submit()
+
+		# Entered rate is not what the stock cost, FIFO takes 5 at 500 and 2 at 1000 out of the source
+		stock_entry = new_stock_entry("Transfer", self.item.name, 7, self.warehouse.name, self.warehouse2.name, 900)
+		stock_entry.submit()
+
+		target_entry = frappe.get_doc("Stock Ledger Entry", {"stock_entry": stock_entry.name,
+															 "warehouse": self.warehouse2.name})
+		self.assertAlmostEqual(target_entry.in_out_rate, 4500 / 7)
+		self.assertAlmostEqual(target_entry.stock_value_difference, 4500)
+
+		# Check if the total stock value did not change
+		source_bin = get_bin_details(self.item.name, self.warehouse.name)
+		target_bin = get_bin_details(self.item.name, self.warehouse2.name)
+		self.assertAlmostEqual(source_bin.stock_value + target_bin.stock_value, 7500)
+
 	def test_cancel_for_consuming_items(self):
 		# Create a new stock entry
 		stock_entry = new_stock_entry("Consume", self.item.name, 2, self.warehouse.name, "", 500)
@@ -238,6 +312,153 @@ class TestStockEntry(FrappeTestCase):
 		self._check_ledger_entry_reversal(ledger_entry_on_submit_type_consume_id,
 										  ledger_entry_on_cancel_type_receive_id)
 
+	def test_cancel_restores_bin_and_leaves_items_untouched(self):
+		new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 1000).submit()
+		bin_before = get_bin_details(self.item.name, self.warehouse.name)
+
+		# consume across both FIFO layers, then cancel
+		stock_entry = new_stock_entry("Consume", self.item.name, 7, self.warehouse.name, "", 500)
+		stock_entry.submit()
+		stock_entry.cancel()
+
+		# Check if the bin is back where it was
+		bin_after = get_bin_details(self.item.name, self.warehouse.name)
+		self.assertEqual(bin_after.actual_qty, bin_before.actual_qty)
+		self.assertEqual(bin_after.stock_value, bin_before.stock_value)
+		self.assertEqual(bin_after.valuation_rate, 750)
+
+		# Check if the reversal negates the stored entry exactly and both are marked cancelled
+		sl_entries = frappe.get_all("Stock Ledger Entry", filters={"stock_entry": stock_entry.name},
+									fields=["name", "qty_change", "stock_value_difference", "is_cancelled",
+											"reversal_of"], order_by="posting_datetime, name")
+		self.assertEqual(len(sl_entries), 2)
+		self.assertEqual(sl_entries[1].reversal_of, sl_entries[0].name)
+		self.assertEqual(sl_entries[1].qty_change, -sl_entries[0].qty_change)
+		self.assertEqual(sl_entries[1].stock_value_difference, -sl_entries[0].stock_value_difference)
+		self.assertTrue(sl_entries[0].is_cancelled and sl_entries[1].is_cancelled)
+
+		# Child rows are left as submitted
+		stock_entry.reload()
+		self.assertEqual(stock_entry.type, "Consume")
+		self.assertEqual(stock_entry.items[0].source_warehouse, self.warehouse.name)
+		self.assertFalse(stock_entry.items[0].target_warehouse)
+
+	def test_submit_in_background(self):
+		frappe.db.set_single_value("Stock Settings", "background_submit_threshold", 1)
+		self.addCleanup(frappe.db.set_single_value, "Stock Settings", "background_submit_threshold", 500)
+		stock_entry = new_stock_entry("Receive", self.item.name, 2, "", self.warehouse.name, 500)
+		stock_entry.append("items", {"item": self.item.name, "qty": 3, "target_warehouse": self.warehouse2.name,
+									 "rate": 500})
+		stock_entry.save()
+
+		# The job runs right away in tests, keep it inside the test transaction
+		with patch.object(frappe.db, "commit"), patch.object(frappe.db, "rollback"):
+			stock_entry.submit()
+		stock_entry.reload()
+		self.assertEqual(stock_entry.docstatus, 1)
+		self.assertFalse(stock_entry.submission_status)
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse2.name).actual_qty, 3)
+
+		# Stock runs out between saving and submitting, the failure is kept on the draft
+		stock_entry = new_stock_entry("Consume", self.item.name, 5, self.warehouse.name, "", 500)
+		stock_entry.append("items", {"item": self.item.name, "qty": 1, "source_warehouse": self.warehouse2.name,
+									 "rate": 500})
+		stock_entry.save()
+		new_stock_entry("Consume", self.item.name, 5, self.warehouse.name, "", 500).submit()
+		with patch.object(frappe.db, "commit"), patch.object(frappe.db, "rollback"):
+			stock_entry.submit()
+		stock_entry.reload()
+		self.assertEqual(stock_entry.docstatus, 0)
+		self.assertEqual(stock_entry.submission_status, "Failed")
+		self.assertIn("Not enough stock", stock_entry.submission_error)
+		self.assertFalse(frappe.db.exists("Stock Ledger Entry", {"stock_entry": stock_entry.name}))
+
+	def test_submit_from_form_in_background(self):
+		frappe.db.set_single_value("Stock Settings", "background_submit_threshold", 1)
+		self.addCleanup(frappe.db.set_single_value, "Stock Settings", "background_submit_threshold", 500)
+		stock_entry = new_stock_entry("Receive", self.item.name, 2, "", self.warehouse.name, 500)
+		stock_entry.append("items", {"item": self.item.name, "qty": 3, "target_warehouse": self.warehouse2.name,
+									 "rate": 500})
+		stock_entry.save()
+
+		# Submit the way the desk form does, the job is only queued
+		with patch.object(frappe, "enqueue") as enqueue:
+			savedocs(stock_entry.as_json(), "Submit")
+		self.assertEqual(enqueue.call_args.kwargs["stock_entry"], stock_entry.name)
+		stock_entry.reload()
+		self.assertEqual(stock_entry.docstatus, 0)
+		self.assertEqual(stock_entry.submission_status, "Queued")
+		self.assertFalse(frappe.db.exists("Stock Ledger Entry", {"stock_entry": stock_entry.name}))
+
+	def test_insert_as_submitted_in_background(self):
+		frappe.db.set_single_value("Stock Settings", "background_submit_threshold", 1)
+		self.addCleanup(frappe.db.set_single_value, "Stock Settings", "background_submit_threshold", 500)
+		stock_entry = frappe.get_doc({
+			"doctype": "Stock Entry",
+			"type": "Receive",
+			"date": frappe.utils.nowdate(),
+			"time": frappe.utils.nowtime(),
+			"docstatus": 1,
+			"items": [
+				{"item": self.item.name, "qty": 2, "target_warehouse": self.warehouse.name, "rate": 500},
+				{"item": self.item.name, "qty": 3, "target_warehouse": self.warehouse2.name, "rate": 500},
+			]
+		})
+
+		# Inserted as submitted the way the REST API does, it is saved as a draft and queued
+		with patch.object(frappe, "enqueue") as enqueue:
+			stock_entry.insert()
+		self.assertEqual(enqueue.call_args.kwargs["stock_entry"], stock_entry.name)
+		stock_entry.reload()
+		self.assertEqual(stock_entry.docstatus, 0)
+		self.assertEqual(stock_entry.submission_status, "Queued")
+		self.assertFalse(frappe.db.exists("Stock Ledger Entry", {"stock_entry": stock_entry.name}))
+
+	def test_stale_background_submit_fails(self):
+		stock_entry = new_stock_entry("Receive", self.item.name, 2, "", self.warehouse.name, 500)
+		frappe.db.set_value("Stock Entry", stock_entry.name, {
+			"submission_status": "Processing",
+			"modified": frappe.utils.add_to_date(frappe.utils.now_datetime(), hours=-2)
+		}, update_modified=False)
+
+		# Its worker was killed, the entry can be submitted again
+		with patch.object(frappe.db, "commit"):
+			fail_stale_background_submits()
+		stock_entry.reload()
+		self.assertEqual(stock_entry.submission_status, "Failed")
+		stock_entry.submit()
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse.name).actual_qty, 7)
+
+	def test_bulk_posting(self):
+		key = frappe.generate_hash(length=10)
+		entries = [
+			{"idempotency_key": key + "-1", "type": "Receive",
+			 "items": [{"item": self.item.name, "qty": 5, "target_warehouse": self.warehouse2.name, "rate": 1000}]},
+			# takes stock received by the entry before it
+			{"idempotency_key": key + "-2", "type": "Consume",
+			 "items": [{"item": self.item.name, "qty": 7, "source_warehouse": self.warehouse2.name, "rate": 1000}]},
+		]
+		self.assertEqual([result.status for result in post_stock_entries(entries)], ["Not Posted", "Failed"])
+		self.assertFalse(frappe.db.exists("Stock Entry", {"idempotency_key": ["like", key + "%"]}))
+
+		entries[1]["items"][0]["qty"] = 4
+		results = post_stock_entries(entries)
+		self.assertEqual([result.status for result in results], ["Posted", "Posted"])
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse2.name).actual_qty, 1)
+
+		# A retried batch returns the entries posted the first time and posts nothing
+		retried = post_stock_entries(entries)
+		self.assertEqual([result.status for result in retried], ["Already Posted", "Already Posted"])
+		self.assertEqual([result.stock_entry for result in retried], [result.stock_entry for result in results])
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse2.name).actual_qty, 1)
+
+		# An entry another batch posted while this one didn't see it yet is answered the same way
+		with patch.object(stock_posting, "_get_posted", return_value={}):
+			retried = post_stock_entries(entries[:1])
+		self.assertEqual(retried[0].status, "Already Posted")
+		self.assertEqual(retried[0].stock_entry, results[0].stock_entry)
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse2.name).actual_qty, 1)
+
 	def test_valuation_method_fifo(self):
 		# switch to FIFO
 		update_valuation_method("FIFO")
@@ -251,6 +472,35 @@ class TestStockEntry(FrappeTestCase):
 		valuation = calculate_valuation(item.name, self.warehouse.name)
 		self.assertEquals(valuation, 700, "Check if valuation rate is correct")
 
+	def test_valuation_method_fifo_consumes_oldest_layers_first(self):
+		update_valuation_method("FIFO")
+		item = create_item("Test Item", self.warehouse.name, 5, 500)
+		new_stock_entry("Receive", item.name, 5, "", self.warehouse.name, 1000).submit()
+		self.assertEqual(calculate_valuation(item.name, self.warehouse.name), 750, "Check if valuation rate is correct")
+
+		# 5 units @ 500 and 1 unit @ 1000 leave the warehouse, 4 units @ 1000 stay
+		new_stock_entry("Consume", item.name, 6, self.warehouse.name, "", 750).submit()
+		self.assertEqual(calculate_valuation(item.name, self.warehouse.name), 1000, "Check if valuation rate is correct")
+		bin_details = get_bin_details(item.name, self.warehouse.name)
+		self.assertEqual(bin_details.stock_value, 4000, "Check if stock value is correct")
+		self.assertEqual(json.loads(bin_details.fifo_queue), [[4, 1000]], "Check if FIFO queue is correct")
+
+	def test_valuation_method_fifo_below_zero(self):
+		# Bin held stock at 500 before, a backdated consume replayed by a repost takes it below zero
+		state = frappe._dict(actual_qty=0, stock_value=0, valuation_rate=500, fifo_queue=None)
+		for qty_change, rate in ((-3, 0), (5, 200), (-2, 0)):
+			valuation = value_stock_change(state, qty_change, rate, "FIFO", qty_change < 0)
+			state = frappe._dict(actual_qty=valuation.qty_after_transaction,
+								 stock_value=valuation.stock_value_after_transaction,
+								 valuation_rate=valuation.valuation_rate, fifo_queue=valuation.fifo_queue)
+			# Check if the stock value stays equal to the value of the FIFO queue
+			self.assertEqual(state.stock_value, sum(qty * rate for qty, rate in json.loads(state.fifo_queue)))
+			if qty_change == -3:
+				# stock below zero is valued at the last valuation rate
+				self.assertEqual(state.stock_value, -1500)
+		self.assertEqual(state.actual_qty, 0)
+		self.assertEqual(state.stock_value, 0)
+
 	def test_valuation_method_moving_average(self):
 		# switch to `Moving Average`
 		update_valuation_method("Moving Average")
@@ -261,8 +511,9 @@ class TestStockEntry(FrappeTestCase):
 		new_stock_entry("Receive", item.name, 2, "", self.warehouse.name, 1000).save().submit()
 
 		# Get valuation rate
+		# (3 * 500 + 2 * 1000) / 5, consumption doesn't change the moving average
 		valuation = calculate_valuation(item.name, self.warehouse.name)
-		self.assertEquals(math.ceil(valuation), 667, "Check if valuation rate is correct")
+		self.assertEquals(math.ceil(valuation), 700, "Check if valuation rate is correct")
 
 	def _check_ledger_entry_reversal(self, ledger_entry_on_submit_id: str, ledger_entry_on_cancel_id: str):
 		ledger_entry_on_submit = frappe.get_doc("Stock Ledger Entry", ledger_entry_on_submit_id)
@@ -275,3 +526,59 @@ class TestStockEntry(FrappeTestCase):
 						  "Check if in/out rate is same")
 		self.assertEquals(ledger_entry_on_submit.warehouse, ledger_entry_on_cancel.warehouse,
 						  "Check if warehouse is same")
+
+
+class TestStockEntryConcurrency(FrappeTestCase):
+	# Entries are submitted by other processes, which commit, so everything made here is deleted in tearDown
+	def setUp(self):
+		update_valuation_method("FIFO")
+		self.warehouse = create_warehouse("Test Warehouse")
+		self.warehouse2 = create_warehouse("Test Warehouse 2")
+		self.item = create_item("Test Item", self.warehouse.name, 10, 500)
+		self.item2 = create_item("Test Item 2", self.warehouse2.name, 100, 500)
+		frappe.db.commit()
+
+	def tearDown(self):
+		frappe.db.rollback()
+		items = [self.item.name, self.item2.name]
+		stock_entries = frappe.get_all("Stock Entry Transaction", filters={"item": ["in", items]}, pluck="parent")
+		for doctype, filters in (
+				("Stock Ledger Entry", {"item": ["in", items]}),
+				("Stock Repost Queue", {"item": ["in", items]}),
+				("Bin", {"item": ["in", items]}),
+				("Stock Entry Transaction", {"parent": ["in", stock_entries]}),
+				("Stock Entry", {"name": ["in", stock_entries]}),
+				("Item", {"name": ["in", items]}),
+				("Warehouse", {"name": ["in", [self.warehouse.name, self.warehouse2.name]]})):
+			frappe.db.delete(doctype, filters)
+		frappe.db.commit()
+
+	def submit_in_parallel(self, processes: int, *args, count: int) -> list:
+		with multiprocessing.get_context("spawn").Pool(processes) as pool:
+			return pool.starmap_async(submit_stock_entry_in_new_process,
+									  [(frappe.local.site, frappe.local.sites_path, *args)] * count).get(timeout=120)
+
+	def test_concurrent_consumes_do_not_oversell(self):
+		# 20 processes race to consume 1 of the 10 units in stock
+		results = self.submit_in_parallel(8, "Consume", self.item.name, 1, self.warehouse.name, "", 500, count=20)
+
+		# Start a new transaction to see what the other processes committed
+		frappe.db.rollback()
+		self.assertEqual(results.count(True), 10, "Check if exactly the stock in hand has been consumed")
+		self.assertEqual(get_bin_details(self.item.name, self.warehouse.name).actual_qty, 0)
+		self.assertEqual(frappe.db.count("Stock Ledger Entry", {"item": self.item.name, "qty_change": -1}), 10)
+
+	def test_unrelated_bins_are_not_blocked(self):
+		# Hold the lock on the first bin for the whole test
+		lock_bins([(self.item.name, self.warehouse.name)])
+
+		# Submits on another bin go through while it is held
+		started = time.monotonic()
+		results = self.submit_in_parallel(4, "Consume", self.item2.name, 1, self.warehouse2.name, "", 500, count=20)
+		elapsed = time.monotonic() - started
+		self.assertEqual(results, [True] * 20)
+		# far below the lock wait timeout that a submit blocked by the held bin would run into
+		self.assertLess(elapsed, 30)
+
+		frappe.db.rollback()
+		self.assertEqual(get_bin_details(self.item2.name, self.warehouse2.name).actual_qty, 80)
@@ -6,8 +6,4 @@ from frappe.model.document import Document
 
 
 class StockEntryTransaction(Document):
-
-	# This function will create a deep copy and reverse the transaction
-	def reverse_transaction(self):
-		# swap source and target warehouse
-		self.source_warehouse, self.target_warehouse = self.target_warehouse, self.source_warehouse
\ No newline at end of file
+	pass
@@ -1,9 +1,35 @@
 # Copyright (c) 2023, Tanmoy Sarkar and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from inventory_management.inventory_management.stock_ledger import make_time_ordered_names, \
+	uses_time_ordered_names
+
 
 class StockLedgerEntry(Document):
-	pass
+
+	def autoname(self):
+		# entries inserted one by one, make_sl_entries names its entries up front
+		if uses_time_ordered_names():
+			self.name = make_time_ordered_names(1, "SLE-")[0]
+
+	def validate(self):
+		# keep the combined column in sync with posting date and time
+		self.posting_datetime = get_posting_datetime(self.posting_date, self.posting_time)
+
+
+def get_posting_datetime(posting_date, posting_time):
+	return frappe.utils.get_datetime("{} {}".format(frappe.utils.getdate(posting_date),
+												  frappe.utils.get_time(posting_time)))
+
+
+def on_doctype_update():
+	# latest entry / running totals of an item in a warehouse
+	frappe.db.add_index("Stock Ledger Entry", ["item", "warehouse", "posting_datetime"],
+						"item_warehouse_posting_datetime_index")
+	# ledger entries of a stock entry
+	frappe.db.add_index("Stock Ledger Entry", ["stock_entry"], "stock_entry_index")
+	# date range scans of the reports
+	frappe.db.add_index("Stock Ledger Entry", ["posting_datetime"], "posting_datetime_index")
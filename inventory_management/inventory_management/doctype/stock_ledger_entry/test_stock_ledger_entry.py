@@ -1,8 +1,93 @@
 # Copyright (c) 2023, Tanmoy Sarkar and Contributors
 # See license.txt
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from inventory_management.inventory_management.doctype.item.test_item import create_item
+from inventory_management.inventory_management.doctype.warehouse.test_warehouse import create_warehouse
+from inventory_management.inventory_management.doctype.stock_entry.test_stock_entry import new_stock_entry
+from inventory_management.inventory_management.doctype.stock_settings.test_stock_settings import update_valuation_method
+from inventory_management.inventory_management.stock_ledger import get_stock_balances_as_of, get_valuation_rates, \
+	make_sl_entries, make_time_ordered_names
+
+
+def get_sl_entry(item: str, warehouse: str, qty_change: int, rate: float) -> dict:
+	return {
+		"item": item,
+		"warehouse": warehouse,
+		"qty_change": qty_change,
+		"in_out_rate": rate,
+		"valuation_rate": rate,
+		"posting_date": frappe.utils.nowdate(),
+		"posting_time": frappe.utils.nowtime()
+	}
 
 
 class TestStockLedgerEntry(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.warehouse = create_warehouse("Test Warehouse")
+		self.item = create_item("Test Item", self.warehouse.name, 5, 500)
+
+	def test_bulk_insert(self):
+		docs = make_sl_entries([get_sl_entry(self.item.name, self.warehouse.name, 1, 500) for _ in range(50)])
+
+		# Check if every entry has been written with its own name
+		names = [doc.name for doc in docs]
+		self.assertEqual(len(set(names)), 50, "Check if every ledger entry got a unique name")
+		self.assertEqual(frappe.db.count("Stock Ledger Entry", {"name": ["in", names]}), 50,
+						 "Check if every ledger entry has been inserted")
+
+	def test_bulk_insert_validates_links(self):
+		self.assertRaises(frappe.exceptions.LinkValidationError, make_sl_entries,
+						  [get_sl_entry(self.item.name, "Missing Warehouse", 1, 500)])
+
+	def test_stock_balances_as_of(self):
+		update_valuation_method("FIFO")
+		warehouse2 = create_warehouse("Test Warehouse 2")
+		new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 1000).submit()
+
+		balances = get_stock_balances_as_of(
+			[[self.item.name, self.warehouse.name], [self.item.name, warehouse2.name]], frappe.utils.now_datetime())
+		self.assertEqual(len(balances), 2)
+		self.assertEqual(balances[0].qty, 10)
+		self.assertEqual(balances[0].stock_value, 7500)
+		self.assertEqual(balances[0].valuation_rate, 750)
+		# Nothing has been posted in the second warehouse
+		self.assertEqual(balances[1].qty, 0)
+		self.assertEqual(balances[1].stock_value, 0)
+
+		# Nothing had been posted yesterday
+		balances = get_stock_balances_as_of([[self.item.name, self.warehouse.name]],
+											frappe.utils.add_days(frappe.utils.now_datetime(), -1))
+		self.assertEqual(balances[0].qty, 0)
+
+	def test_valuation_rate_cache(self):
+		update_valuation_method("FIFO")
+		pair = (self.item.name, self.warehouse.name)
+		self.assertEqual(get_valuation_rates([pair])[pair], 500)
+
+		# Writing ledger entries of the bin drops its cached rate
+		new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 1000).submit()
+		self.assertEqual(get_valuation_rates([pair])[pair], 750)
+
+	def test_ledger_naming(self):
+		# Time ordered names made by one process sort in the order the entries were written, even within the
+		# same millisecond
+		frappe.db.set_single_value("Stock Settings", "ledger_naming", "Time Ordered")
+		first = make_sl_entries([get_sl_entry(self.item.name, self.warehouse.name, 1, 500) for _ in range(3)])
+		second = make_sl_entries([get_sl_entry(self.item.name, self.warehouse.name, 1, 500)])
+		names = [doc.name for doc in first + second]
+		self.assertEqual(names, sorted(names))
+		self.assertTrue(all(name.startswith("SLE-") for name in names))
+		# and after the names of the naming series used before
+		self.assertGreater(names[0], "SLE-9999999999")
+		names = [name for _ in range(100) for name in make_time_ordered_names(2, "SLE-")]
+		self.assertEqual(names, sorted(names))
+		self.assertEqual(len(set(names)), 200)
+
+		# Naming series reserves consecutive numbers
+		frappe.db.set_single_value("Stock Settings", "ledger_naming", "Series")
+		names = [doc.name for doc in make_sl_entries([get_sl_entry(self.item.name, self.warehouse.name, 1, 500)
+													  for _ in range(3)])]
+		numbers = [int(name.removeprefix("SLE-")) for name in names]
+		self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 3)))
+		frappe.db.set_single_value("Stock Settings", "ledger_naming", "Time Ordered")
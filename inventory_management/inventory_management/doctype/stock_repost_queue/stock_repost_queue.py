@@ -0,0 +1,228 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder import Order
+from frappe.utils import flt
+
+from inventory_management.inventory_management.doctype.stock_ledger_entry.stock_ledger_entry import \
+	get_posting_datetime
+from inventory_management.inventory_management.report_cache import bump_ledger_version
+from inventory_management.inventory_management.stock_ledger import clear_valuation_rate_cache
+from inventory_management.inventory_management.valuation import FIFOValuation, get_transfer_rate, \
+	reverse_stock_change, value_stock_change
+
+REPOST_CHUNK_SIZE = 1000
+# days completed requests are kept for
+KEEP_COMPLETED_DAYS = 30
+
+
+class StockRepostQueue(Document):
+	pass
+
+
+def on_doctype_update():
+	# request still queued for a bin, looked up with a locking read on every backdated posting
+	frappe.db.add_index("Stock Repost Queue", ["item", "warehouse", "status"], "item_warehouse_status_index")
+	# requests waiting for the worker
+	frappe.db.add_index("Stock Repost Queue", ["status"], "status_index")
+
+
+def clear_completed_requests():
+	# Completed requests are only of use for a while, failed ones are kept until looked into
+	frappe.db.delete("Stock Repost Queue", {
+		"status": "Completed",
+		"modified": ["<", frappe.utils.add_days(frappe.utils.now_datetime(), -KEEP_COMPLETED_DAYS)],
+	})
+
+
+def queue_repost(item: str, warehouse: str, posting_date, posting_time) -> str:
+	# Record that the ledger of item in warehouse has to be recomputed from posting date and time on
+	# A request still queued for the same bin is moved back instead of adding another one
+	posting_datetime = get_posting_datetime(posting_date, posting_time)
+	queued = frappe.db.get_value("Stock Repost Queue", {"item": item, "warehouse": warehouse, "status": "Queued"},
+								 ["name", "posting_date", "posting_time"], as_dict=True, for_update=True)
+	if queued:
+		if posting_datetime < get_posting_datetime(queued.posting_date, queued.posting_time):
+			frappe.db.set_value("Stock Repost Queue", queued.name, {"posting_date": posting_datetime.date(),
+																	"posting_time": posting_datetime.time()})
+		return queued.name
+
+	doc = frappe.get_doc({
+		"doctype": "Stock Repost Queue",
+		"item": item,
+		"warehouse": warehouse,
+		"posting_date": posting_datetime.date(),
+		"posting_time": posting_datetime.time(),
+	})
+	doc.flags.ignore_permissions = True
+	doc.insert()
+	frappe.enqueue("inventory_management.inventory_management.doctype.stock_repost_queue.stock_repost_queue"
+				   ".process_repost_queue", queue="long", job_id="process_stock_repost_queue", deduplicate=True,
+				   enqueue_after_commit=True)
+	return doc.name
+
+
+def process_repost_queue():
+	# Background worker, also run by the scheduler to pick up anything left behind
+	# Reposts can queue more of them for the target bins of transfers, keep going until none is left
+	while names := frappe.get_all("Stock Repost Queue", filters={"status": "Queued"}, order_by="creation",
+								  pluck="name"):
+		for name in names:
+			# Claim the request, another worker may have taken it in the meantime
+			request = frappe.db.get_value("Stock Repost Queue", name,
+										  ["status", "item", "warehouse", "posting_date", "posting_time"],
+										  as_dict=True, for_update=True)
+			if not request or request.status != "Queued":
+				frappe.db.commit()
+				continue
+			frappe.db.set_value("Stock Repost Queue", name, "status", "In Progress")
+			frappe.db.commit()
+
+			# Nothing is read before repost_bin locks the bin, see there
+			try:
+				repost_bin(request.item, request.warehouse, request.posting_date, request.posting_time)
+				frappe.db.set_value("Stock Repost Queue", name, {"status": "Completed", "error_log": None})
+				frappe.db.commit()
+			except Exception:
+				frappe.db.rollback()
+				frappe.db.set_value("Stock Repost Queue", name, {"status": "Failed",
+																  "error_log": frappe.get_traceback()})
+				frappe.db.commit()
+
+
+def repost_bin(item: str, warehouse: str, posting_date, posting_time):
+	# Recompute valuation and running balances of every ledger entry of item in warehouse from posting date and
+	# time on, chunk by chunk, then set the bin to the state after the last entry
+	# Bin stays locked so that no submit on it interleaves with the repost
+	# The lock has to be the first read of the transaction, the snapshot of the plain reads below is taken by the
+	# first of them, after the lock is granted, so that they see every entry committed while waiting for it
+	bin_name = frappe.db.get_value("Bin", {"item": item, "warehouse": warehouse}, for_update=True)
+	if not bin_name:
+		return
+
+	valuation_method = frappe.get_doc("Stock Settings").valuation_method
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	posting_datetime = get_posting_datetime(posting_date, posting_time)
+
+	state = _get_state_before(item, warehouse, posting_datetime)
+	# value change of the cancelled entries met so far, their reversals undo exactly that
+	cancelled_value_changes = {}
+	cursor = None
+	while True:
+		query = (frappe.qb.from_(doctype)
+				 .select(doctype.name, doctype.posting_datetime, doctype.qty_change, doctype.in_out_rate,
+						 doctype.stock_value_difference, doctype.is_cancelled, doctype.reversal_of, doctype.stock_entry)
+				 .where(doctype.item == item)
+				 .where(doctype.warehouse == warehouse)
+				 .orderby(doctype.posting_datetime)
+				 .orderby(doctype.name)
+				 .limit(REPOST_CHUNK_SIZE))
+		if cursor:
+			query = query.where(
+				(doctype.posting_datetime > cursor.posting_datetime)
+				| ((doctype.posting_datetime == cursor.posting_datetime) & (doctype.name > cursor.name))
+			)
+		else:
+			query = query.where(doctype.posting_datetime >= posting_datetime)
+		entries = query.run(as_dict=True)
+		if not entries:
+			break
+
+		updates = {}
+		# issues whose cost changed, by (stock entry, qty), in case they are the source legs of transfers
+		changed_issues = {}
+		for entry in entries:
+			if entry.reversal_of:
+				# the original comes before its reversal, if it is before the repost start its value is as stored
+				original_value_change = cancelled_value_changes.get(entry.reversal_of,
+																	-(entry.stock_value_difference or 0))
+				valuation = reverse_stock_change(state, -entry.qty_change, original_value_change,
+												 entry.in_out_rate, valuation_method)
+			else:
+				valuation = value_stock_change(state, entry.qty_change, entry.in_out_rate, valuation_method,
+											   entry.qty_change < 0)
+				if entry.is_cancelled:
+					cancelled_value_changes[entry.name] = valuation.value_change
+				elif (entry.qty_change < 0 and entry.stock_entry
+					  and flt(valuation.value_change, 6) != flt(entry.stock_value_difference, 6)):
+					changed_issues[(entry.stock_entry, -entry.qty_change)] = (
+						entry.name, get_transfer_rate(valuation.value_change, -entry.qty_change))
+			updates[entry.name] = {
+				"valuation_rate": valuation.valuation_rate,
+				"stock_value_difference": valuation.value_change,
+				"qty_after_transaction": valuation.qty_after_transaction,
+				"stock_value_after_transaction": valuation.stock_value_after_transaction,
+				"fifo_queue": valuation.fifo_queue,
+			}
+			state = frappe._dict(actual_qty=valuation.qty_after_transaction,
+								 stock_value=valuation.stock_value_after_transaction,
+								 valuation_rate=valuation.valuation_rate, fifo_queue=valuation.fifo_queue)
+		_carry_cost_to_transfer_targets(item, warehouse, changed_issues, updates)
+		frappe.db.bulk_update("Stock Ledger Entry", updates, update_modified=False)
+		cursor = entries[-1]
+
+	frappe.db.set_value("Bin", bin_name, {
+		"actual_qty": state.actual_qty,
+		"stock_value": state.stock_value,
+		"valuation_rate": state.valuation_rate,
+		"fifo_queue": state.fifo_queue,
+	}, update_modified=False)
+	clear_valuation_rate_cache([(item, warehouse)])
+	bump_ledger_version()
+
+
+def _carry_cost_to_transfer_targets(item: str, warehouse: str, changed_issues: dict, updates: dict):
+	# Target legs of transfers out of this bin receive stock at the cost it left at, carry the new cost over to them
+	# and queue their bins for a repost from the transfer on
+	if not changed_issues:
+		return
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	target_entries = (frappe.qb.from_(doctype)
+					  .select(doctype.name, doctype.stock_entry, doctype.warehouse, doctype.qty_change,
+							  doctype.posting_date, doctype.posting_time)
+					  .where(doctype.stock_entry.isin(list({stock_entry for stock_entry, _ in changed_issues})))
+					  .where(doctype.item == item)
+					  .where(doctype.warehouse != warehouse)
+					  .where(doctype.qty_change > 0)
+					  .where(doctype.is_cancelled == 0)
+					  .run(as_dict=True))
+	target_updates = {}
+	for target_entry in target_entries:
+		issue = changed_issues.get((target_entry.stock_entry, target_entry.qty_change))
+		if not issue:
+			continue
+		issue_name, transfer_rate = issue
+		updates[issue_name]["in_out_rate"] = transfer_rate
+		target_updates[target_entry.name] = {"in_out_rate": transfer_rate}
+		queue_repost(item, target_entry.warehouse, target_entry.posting_date, target_entry.posting_time)
+	if target_updates:
+		frappe.db.bulk_update("Stock Ledger Entry", target_updates, update_modified=False)
+
+
+def _get_state_before(item: str, warehouse: str, posting_datetime) -> frappe._dict:
+	# Running balances and FIFO queue of the bin right before posting_datetime
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	previous = (frappe.qb.from_(doctype)
+				.select(doctype.qty_after_transaction, doctype.stock_value_after_transaction,
+						doctype.valuation_rate, doctype.fifo_queue)
+				.where(doctype.item == item)
+				.where(doctype.warehouse == warehouse)
+				.where(doctype.posting_datetime < posting_datetime)
+				.orderby(doctype.posting_datetime, order=Order.desc)
+				.orderby(doctype.name, order=Order.desc)
+				.limit(1)
+				.run(as_dict=True))
+	if not previous:
+		return frappe._dict(actual_qty=0, stock_value=0, valuation_rate=0, fifo_queue=None)
+
+	previous = previous[0]
+	qty, rate = previous.qty_after_transaction or 0, previous.valuation_rate or 0
+	fifo_queue = previous.fifo_queue
+	if fifo_queue is None:
+		# entry written before FIFO queues were stored on the ledger
+		fifo_queue = FIFOValuation([[qty, rate]] if qty else []).to_json()
+	return frappe._dict(actual_qty=qty, stock_value=previous.stock_value_after_transaction or 0,
+						valuation_rate=rate, fifo_queue=fifo_queue)
+
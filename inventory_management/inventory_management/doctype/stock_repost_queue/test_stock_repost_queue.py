@@ -0,0 +1,159 @@
+# Copyright (c) 2026, Tanmoy Sarkar and Contributors
+# See license.txt
+
+import multiprocessing
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from inventory_management.inventory_management.doctype.bin.bin import get_bin_details, lock_bins
+from inventory_management.inventory_management.doctype.item.test_item import create_item
+from inventory_management.inventory_management.doctype.stock_entry.test_stock_entry import new_stock_entry
+from inventory_management.inventory_management.doctype.stock_repost_queue.stock_repost_queue import \
+	clear_completed_requests, process_repost_queue, repost_bin
+from inventory_management.inventory_management.doctype.stock_settings.test_stock_settings import update_valuation_method
+from inventory_management.inventory_management.doctype.warehouse.test_warehouse import create_warehouse
+
+
+def process_repost_queue_in_new_process(site: str, sites_path: str):
+	# Runs the worker in its own process with its own database connection
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	frappe.set_user("Administrator")
+	try:
+		process_repost_queue()
+	finally:
+		frappe.destroy()
+
+
+class TestStockRepostQueue(FrappeTestCase):
+	def setUp(self):
+		update_valuation_method("FIFO")
+		self.warehouse = create_warehouse("Test Warehouse")
+		self.item = create_item("Test Item", self.warehouse.name, 5, 500)
+		new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 1000).submit()
+
+	def test_backdated_entry_is_reposted(self):
+		# Receive stock yesterday, before every existing ledger entry of the bin
+		stock_entry = new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 200)
+		stock_entry.date = frappe.utils.add_days(frappe.utils.nowdate(), -1)
+		stock_entry.save()
+		stock_entry.submit()
+
+		# Check if a repost has been queued from the backdated posting
+		request = frappe.get_doc("Stock Repost Queue", {"item": self.item.name, "warehouse": self.warehouse.name,
+														"status": "Queued"})
+		self.assertEqual(str(request.posting_date), str(stock_entry.date))
+
+		# Another backdated entry for the same bin reuses the queued request
+		stock_entry = new_stock_entry("Receive", self.item.name, 1, "", self.warehouse.name, 200)
+		stock_entry.date = frappe.utils.add_days(frappe.utils.nowdate(), -2)
+		stock_entry.save()
+		stock_entry.submit()
+		self.assertEqual(frappe.db.count("Stock Repost Queue", {"item": self.item.name, "status": "Queued"}), 1)
+		request.reload()
+		self.assertEqual(str(request.posting_date), str(stock_entry.date))
+
+		repost_bin(request.item, request.warehouse, request.posting_date, request.posting_time)
+
+		# Opening stock now comes after the backdated receipts
+		opening_entry = frappe.get_doc("Stock Ledger Entry", {"item": self.item.name, "warehouse": self.warehouse.name,
+															  "in_out_rate": 500})
+		self.assertEqual(opening_entry.qty_after_transaction, 11)
+		self.assertEqual(opening_entry.stock_value_after_transaction, 1200 + 2500)
+
+		# Check if the bin holds the state after the last entry
+		bin_details = get_bin_details(self.item.name, self.warehouse.name)
+		self.assertEqual(bin_details.actual_qty, 16)
+		self.assertEqual(bin_details.stock_value, 1200 + 2500 + 5000)
+		self.assertAlmostEqual(bin_details.valuation_rate, 8700 / 16)
+
+	def test_repost_carries_cost_to_transfer_target(self):
+		warehouse2 = create_warehouse("Test Warehouse 2")
+		stock_entry = new_stock_entry("Transfer", self.item.name, 5, self.warehouse.name, warehouse2.name, 500)
+		stock_entry.submit()
+
+		# Receive stock yesterday, the transfer now takes it out of the source first
+		backdated_entry = new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 200)
+		backdated_entry.date = frappe.utils.add_days(frappe.utils.nowdate(), -1)
+		backdated_entry.save()
+		backdated_entry.submit()
+		repost_bin(self.item.name, self.warehouse.name, backdated_entry.date, backdated_entry.time)
+
+		# Check if the target leg takes the new cost and the target bin is queued for a repost
+		target_entry = frappe.get_doc("Stock Ledger Entry", {"stock_entry": stock_entry.name,
+															 "warehouse": warehouse2.name})
+		self.assertEqual(target_entry.in_out_rate, 200)
+		self.assertTrue(frappe.db.exists("Stock Repost Queue", {"item": self.item.name, "warehouse": warehouse2.name,
+																"status": "Queued"}))
+
+		repost_bin(self.item.name, warehouse2.name, target_entry.posting_date, target_entry.posting_time)
+		self.assertEqual(get_bin_details(self.item.name, warehouse2.name).stock_value, 1000)
+
+
+	def test_old_completed_requests_are_cleared(self):
+		requests = {}
+		for status in ("Completed", "Failed"):
+			request = frappe.get_doc({
+				"doctype": "Stock Repost Queue",
+				"item": self.item.name,
+				"warehouse": self.warehouse.name,
+				"posting_date": frappe.utils.nowdate(),
+				"posting_time": frappe.utils.nowtime(),
+				"status": status,
+			}).insert()
+			frappe.db.set_value("Stock Repost Queue", request.name, "modified",
+								frappe.utils.add_days(frappe.utils.now_datetime(), -31), update_modified=False)
+			requests[status] = request.name
+
+		clear_completed_requests()
+		self.assertFalse(frappe.db.exists("Stock Repost Queue", requests["Completed"]))
+		# failed ones are kept until looked into
+		self.assertTrue(frappe.db.exists("Stock Repost Queue", requests["Failed"]))
+
+
+class TestStockRepostQueueConcurrency(FrappeTestCase):
+	# The worker runs in another process and commits, so everything made here is deleted in tearDown
+	def setUp(self):
+		update_valuation_method("FIFO")
+		self.warehouse = create_warehouse("Test Warehouse")
+		self.item = create_item("Test Item", self.warehouse.name, 5, 500)
+		frappe.db.commit()
+
+	def tearDown(self):
+		frappe.db.rollback()
+		stock_entries = frappe.get_all("Stock Entry Transaction", filters={"item": self.item.name}, pluck="parent")
+		for doctype, filters in (
+				("Stock Ledger Entry", {"item": self.item.name}),
+				("Stock Repost Queue", {"item": self.item.name}),
+				("Bin", {"item": self.item.name}),
+				("Stock Entry Transaction", {"parent": ["in", stock_entries]}),
+				("Stock Entry", {"name": ["in", stock_entries]}),
+				("Item", {"name": self.item.name}),
+				("Warehouse", {"name": self.warehouse.name})):
+			frappe.db.delete(doctype, filters)
+		frappe.db.commit()
+
+	def test_submit_while_repost_waits_for_the_bin(self):
+		stock_entry = new_stock_entry("Receive", self.item.name, 5, "", self.warehouse.name, 200)
+		stock_entry.date = frappe.utils.add_days(frappe.utils.nowdate(), -1)
+		stock_entry.save()
+		stock_entry.submit()
+		frappe.db.commit()
+
+		# Hold the bin while the worker claims the request and waits for it
+		lock_bins([(self.item.name, self.warehouse.name)])
+		with multiprocessing.get_context("spawn").Pool(1) as pool:
+			result = pool.apply_async(process_repost_queue_in_new_process, (frappe.local.site, frappe.local.sites_path))
+			time.sleep(5)
+			# Submit on the bin and commit, which lets the worker go on
+			new_stock_entry("Receive", self.item.name, 2, "", self.warehouse.name, 1000).submit()
+			frappe.db.commit()
+			result.get(timeout=120)
+
+		# Check if the repost took the entry committed while it waited into account
+		frappe.db.rollback()
+		self.assertEqual(frappe.db.get_value("Stock Repost Queue", {"item": self.item.name}, "status"), "Completed")
+		bin_details = get_bin_details(self.item.name, self.warehouse.name)
+		self.assertEqual(bin_details.actual_qty, 12)
+		self.assertEqual(bin_details.stock_value, 1000 + 2500 + 2000)
@@ -10,8 +10,10 @@ class TestWarehouse(FrappeTestCase):
     pass
 
 
-def create_warehouse(warehouse_name: str) -> Warehouse:
+def create_warehouse(warehouse_name: str, parent_warehouse: str = None, is_group: bool = False) -> Warehouse:
     warehouse = frappe.new_doc("Warehouse")
     warehouse.name1 = warehouse_name
+    warehouse.parent_warehouse = parent_warehouse
+    warehouse.is_group = is_group
     warehouse.save()
     return warehouse
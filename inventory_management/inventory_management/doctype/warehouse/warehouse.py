@@ -4,6 +4,41 @@
 import frappe
 from frappe.utils.nestedset import NestedSet
 
+from inventory_management.inventory_management.report_cache import bump_ledger_version
+
 
 class Warehouse(NestedSet):
-	pass
+
+	def on_update(self):
+		super().on_update()
+		# a group warehouse in the report filters covers the warehouses under it
+		bump_ledger_version()
+
+	def on_trash(self):
+		super().on_trash()
+		bump_ledger_version()
+
+
+def get_descendants_query(warehouse: str):
+	# Subquery of warehouse and every warehouse under it, with a single lft/rgt range join on the tree
+	child, ancestor = frappe.qb.DocType("Warehouse"), frappe.qb.DocType("Warehouse").as_("ancestor")
+	return (frappe.qb.from_(child)
+			.join(ancestor).on((child.lft >= ancestor.lft) & (child.rgt <= ancestor.rgt))
+			.select(child.name)
+			.where(ancestor.name == warehouse))
+
+
+def get_descendant_warehouses(warehouses: list) -> dict:
+	# Every warehouse under each of warehouses, itself included, keyed by warehouse, with one range join for all
+	child, ancestor = frappe.qb.DocType("Warehouse"), frappe.qb.DocType("Warehouse").as_("ancestor")
+	descendants = {warehouse: [] for warehouse in warehouses}
+	if not warehouses:
+		return descendants
+	rows = (frappe.qb.from_(child)
+			.join(ancestor).on((child.lft >= ancestor.lft) & (child.rgt <= ancestor.rgt))
+			.select(ancestor.name.as_("ancestor"), child.name)
+			.where(ancestor.name.isin(list(warehouses)))
+			.run(as_dict=True))
+	for row in rows:
+		descendants[row.ancestor].append(row.name)
+	return descendants
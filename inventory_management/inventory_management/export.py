@@ -0,0 +1,124 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import csv
+import datetime
+from itertools import islice
+
+import frappe
+from frappe.utils import cint
+
+from inventory_management.inventory_management.report.stock_balance import stock_balance
+from inventory_management.inventory_management.report.stock_ledger import stock_ledger
+
+EXPORTABLE_REPORTS = {
+	"Stock Ledger": (stock_ledger.get_query, stock_ledger.stock_ledger_report_columns),
+	"Stock Balance": (stock_balance.get_query, stock_balance.stock_balance_report_columns),
+}
+CHUNK_SIZE = 10000
+
+
+@frappe.whitelist()
+def export_report(report_name: str, filters=None, file_format: str = "CSV"):
+	# Queue a streamed export of a stock report, the file link is sent to the user once it is written
+	if report_name not in EXPORTABLE_REPORTS:
+		frappe.throw("Report {} cannot be exported".format(report_name))
+	if not frappe.get_doc("Report", report_name).is_permitted():
+		frappe.throw("Not permitted to export report {}".format(report_name), frappe.PermissionError)
+	if file_format not in ("CSV", "Parquet"):
+		frappe.throw("Unsupported export format {}".format(file_format))
+	if file_format == "Parquet":
+		# fail now rather than in the background job
+		_get_pyarrow()
+
+	frappe.enqueue(
+		"inventory_management.inventory_management.export.write_report_file",
+		queue="long",
+		timeout=4 * 60 * 60,
+		report_name=report_name,
+		filters=frappe.parse_json(filters) or {},
+		file_format=file_format,
+		user=frappe.session.user,
+	)
+
+
+def write_report_file(report_name: str, filters: dict, file_format: str, user: str = None) -> str:
+	# Write the report to a private file chunk by chunk and return its url
+	get_query, columns = EXPORTABLE_REPORTS[report_name]
+	fieldnames = [column["fieldname"] for column in columns]
+	file_name = "{}-{}.{}".format(frappe.scrub(report_name), frappe.generate_hash(length=8),
+								  "csv" if file_format == "CSV" else "parquet")
+	path = frappe.get_site_path("private", "files", file_name)
+
+	# Unbuffered cursor streams rows from the database instead of loading the whole result
+	with frappe.db.unbuffered_cursor():
+		rows = get_query(filters).run(as_dict=True, as_iterator=True)
+		if file_format == "CSV":
+			_write_csv(path, fieldnames, _iter_chunks(rows))
+		else:
+			_write_parquet(path, columns, _iter_chunks(rows))
+
+	file_doc = frappe.get_doc({
+		"doctype": "File",
+		"file_name": file_name,
+		"file_url": "/private/files/" + file_name,
+		"is_private": 1,
+	})
+	file_doc.flags.ignore_permissions = True
+	file_doc.insert()
+	if user:
+		frappe.publish_realtime("msgprint", "{} export is ready: <a href='{}'>{}</a>".format(
+			report_name, file_doc.file_url, file_name), user=user)
+	return file_doc.file_url
+
+
+def _iter_chunks(rows):
+	rows = iter(rows)
+	while chunk := list(islice(rows, CHUNK_SIZE)):
+		yield chunk
+
+
+def _write_csv(path: str, fieldnames: list, chunks):
+	with open(path, "w", newline="") as f:
+		writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+		writer.writeheader()
+		for chunk in chunks:
+			writer.writerows(chunk)
+
+
+def _write_parquet(path: str, columns: list, chunks):
+	pa, pq = _get_pyarrow()
+	types = {"Int": pa.int64(), "Float": pa.float64(), "Date": pa.date32()}
+	schema = pa.schema([(column["fieldname"], types.get(column["fieldtype"], pa.string())) for column in columns])
+
+	with pq.ParquetWriter(path, schema) as writer:
+		for chunk in chunks:
+			data = {
+				field.name: [_to_arrow_value(row.get(field.name), field.type, pa) for row in chunk]
+				for field in schema
+			}
+			writer.write_table(pa.table(data, schema=schema))
+
+
+def _to_arrow_value(value, arrow_type, pa):
+	if value is None:
+		return None
+	if arrow_type == pa.int64():
+		return cint(value)
+	if arrow_type == pa.float64():
+		return float(value)
+	if arrow_type == pa.date32():
+		return value
+	if isinstance(value, datetime.timedelta):
+		# Time columns come back from the database as timedelta
+		return frappe.utils.format_timedelta(value)
+	return str(value)
+
+
+def _get_pyarrow():
+	try:
+		import pyarrow
+		import pyarrow.parquet
+	except ImportError:
+		frappe.throw("Install pyarrow to export reports as Parquet")
+	return pyarrow, pyarrow.parquet
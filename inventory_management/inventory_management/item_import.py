@@ -0,0 +1,117 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import csv
+from collections import defaultdict
+from itertools import islice
+
+import frappe
+from frappe.utils import cint, flt
+
+from inventory_management.inventory_management.stock_ledger import bulk_insert_docs, reserve_names, \
+	validate_links
+
+# rows inserted and committed at a time, also the most lines of one opening Stock Entry
+CHUNK_SIZE = 1000
+REQUIRED_COLUMNS = ("name1", "opening_warehouse", "opening_qty", "opening_valuation_rate")
+
+
+@frappe.whitelist()
+def import_items(file_url: str):
+	# Queue the import of the items of an uploaded CSV file, with columns named after the Item fields
+	# The user is notified once it is done
+	frappe.has_permission("Item", "create", throw=True)
+	frappe.has_permission("Stock Entry", "submit", throw=True)
+	file_doc = frappe.get_doc("File", {"file_url": file_url})
+	# a private file of another user is not for this one to import
+	file_doc.check_permission("read")
+	if not file_doc.file_name.lower().endswith(".csv"):
+		frappe.throw("Items can only be imported from a CSV file")
+
+	frappe.enqueue(
+		"inventory_management.inventory_management.item_import.import_items_from_file",
+		queue="long",
+		timeout=4 * 60 * 60,
+		path=file_doc.get_full_path(),
+		user=frappe.session.user,
+	)
+
+
+def import_items_from_file(path: str, user: str = None) -> int:
+	# Read the file chunk by chunk, insert the items of every chunk with one multi-row insert and post their
+	# opening stock as one multi-line Receive entry per warehouse instead of one Stock Entry per item
+	# Every chunk is committed along with its opening stock, returns the number of items imported
+	# A failing row leaves the chunks before it imported in full, the user is told where to pick up
+	imported = 0
+	try:
+		with open(path, newline="") as f:
+			reader = csv.DictReader(f)
+			missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+			if missing:
+				frappe.throw("Missing columns in the file: {}".format(", ".join(missing)))
+
+			while rows := list(islice(reader, CHUNK_SIZE)):
+				items = _insert_items(rows, first_row=imported + 2)
+				opening_lines = defaultdict(list)
+				for item in items:
+					if item.opening_qty:
+						opening_lines[item.opening_warehouse].append(item)
+				for warehouse, lines in opening_lines.items():
+					_make_opening_entry(warehouse, lines)
+				imported += len(items)
+				frappe.db.commit()
+	except Exception as e:
+		frappe.db.rollback()
+		if user:
+			# rows start after the header, on line 2
+			frappe.publish_realtime("msgprint", "Item import stopped: {}<br>{} items up to line {} have been "
+									"imported, import the lines after it again".format(e, imported, imported + 1),
+									user=user)
+		raise
+
+	if user:
+		frappe.publish_realtime("msgprint", "{} items imported".format(imported), user=user)
+	return imported
+
+
+def _insert_items(rows: list, first_row: int) -> list:
+	items = []
+	for row_number, row in enumerate(rows, start=first_row):
+		opening_qty = cint(row.get("opening_qty"))
+		opening_valuation_rate = flt(row.get("opening_valuation_rate"))
+		if opening_qty < 0:
+			frappe.throw("Row {}: Opening qty cannot be negative".format(row_number))
+		if opening_qty and opening_valuation_rate <= 0:
+			frappe.throw("Row {}: Opening valuation rate must be greater than zero".format(row_number))
+		item = frappe.get_doc({
+			"doctype": "Item",
+			"name1": row.get("name1"),
+			"description": row.get("description"),
+			"opening_warehouse": row.get("opening_warehouse"),
+			"opening_qty": opening_qty,
+			"opening_valuation_rate": opening_valuation_rate,
+		})
+		item.flags.skip_opening_stock = True
+		items.append(item)
+
+	validate_links(items, (("Warehouse", "opening_warehouse"),))
+	bulk_insert_docs(items, reserve_names(len(items), "ITEM{:05d}"))
+	return items
+
+
+def _make_opening_entry(warehouse: str, items: list):
+	stock_entry = frappe.new_doc("Stock Entry")
+	stock_entry.type = "Receive"
+	stock_entry.date = frappe.utils.nowdate()
+	stock_entry.time = frappe.utils.nowtime()
+	for item in items:
+		stock_entry.append("items", {
+			"item": item.name,
+			"qty": item.opening_qty,
+			"rate": item.opening_valuation_rate,
+			"target_warehouse": warehouse
+		})
+	# the import is a background job already, submit right away whatever the number of lines
+	stock_entry.flags.in_item_import = True
+	stock_entry.insert()
+	stock_entry.submit()
@@ -34,10 +34,33 @@ frappe.query_reports["Stock Balance"] = {
             "label": "Warehouse",
             "fieldtype": "Link",
             "options": "Warehouse",
+        },
+        {
+            "fieldname": "group_subtotals",
+            "label": "Group Subtotals",
+            "fieldtype": "Check",
         }
 	],
+    "onload": function (report) {
+        ["CSV", "Parquet"].forEach((file_format) => {
+            report.page.add_inner_button(file_format, () => {
+                frappe.call({
+                    method: "inventory_management.inventory_management.export.export_report",
+                    args: {
+                        report_name: "Stock Balance",
+                        filters: report.get_values(),
+                        file_format: file_format
+                    },
+                    callback: () => frappe.show_alert("Export queued, a link will be shown once the file is ready")
+                });
+            }, "Export");
+        });
+    },
     "formatter": function (value, row, column, data, default_formatter) {
         value = default_formatter(value, row, column, data);
+        if (data && data.is_group) {
+            return `<b>${value}</b>`;
+        }
         if (column.fieldname === "in_qty") {
             return format_cell(data.in_qty);
         } else if (column.fieldname === "in_value") {
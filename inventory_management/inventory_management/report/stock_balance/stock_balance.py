@@ -1,11 +1,18 @@
 # Copyright (c) 2023, Tanmoy Sarkar and contributors
 # For license information, please see license.txt
 from pypika import Case, Criterion, Order, AliasedQuery
+from pypika import analytics as an
+from pypika.terms import ValueWrapper
 
 import frappe
 from frappe import _
 
 from frappe.query_builder import functions as fn
+from frappe.utils import add_days, getdate
+
+from inventory_management.inventory_management.doctype.stock_closing_entry.stock_closing_entry import get_last_closing
+from inventory_management.inventory_management.doctype.warehouse.warehouse import get_descendants_query
+from inventory_management.inventory_management.report_cache import get_cached_result
 
 stock_balance_report_columns = [
     {
@@ -68,46 +75,118 @@ stock_balance_report_columns = [
 def execute(filters=None):
     if not filters:
         filters = {}
+    result = get_cached_result("Stock Balance", filters, lambda: get_query(filters).run(as_dict=True))
+    return stock_balance_report_columns, result
 
-    main = frappe.qb.Table("tabStock Ledger Entry", alias="main")
-    sub = frappe.qb.Table("tabStock Ledger Entry", alias="sub")
 
-    main_query_filters = []
-    sub_query_filters = []
+def get_query(filters):
+    stock_ledger_entry = frappe.qb.DocType("Stock Ledger Entry")
+    query_filters = []
 
     if "item" in filters:
-        main_query_filters.append(main.item == filters.get("item"))
+        query_filters.append(stock_ledger_entry.item == filters.get("item"))
     if "warehouse" in filters:
-        main_query_filters.append(main.warehouse == filters.get("warehouse"))
+        # a group warehouse covers every warehouse under it
+        query_filters.append(stock_ledger_entry.warehouse.isin(get_descendants_query(filters.get("warehouse"))))
     if "from_date" in filters:
-        main_query_filters.append(main.posting_date >= filters.get("from_date"))
-        sub_query_filters.append(sub.posting_date >= filters.get("from_date"))
+        query_filters.append(stock_ledger_entry.posting_datetime >= getdate(filters.get("from_date")))
     if "to_date" in filters:
-        main_query_filters.append(main.posting_date <= filters.get("to_date"))
-        sub_query_filters.append(sub.posting_date <= filters.get("to_date"))
+        query_filters.append(stock_ledger_entry.posting_datetime < add_days(filters.get("to_date"), 1))
 
-    sub_query = (frappe.qb.from_(sub)
-                 .select(fn.Round(sub.valuation_rate, 2))
-                 .where(sub.item == main.item)
-                 .where(sub.warehouse == main.warehouse)
-                 .where(Criterion.all(sub_query_filters))
-                 .orderby(sub.posting_date, order=Order.desc)
-                 .orderby(sub.posting_time, order=Order.desc).limit(1))
+    # Without a start date the balances add up from the first entry, start from the latest closing snapshot
+    # instead and add only the entries posted after it
+    closing = None if "from_date" in filters else get_last_closing(filters.get("to_date"))
+    if closing:
+        query_filters.append(stock_ledger_entry.posting_datetime >= add_days(closing.period_end_date, 1))
 
-    data = (frappe.qb.from_(main).select(
-        main.item,
-        main.warehouse,
-        fn.Sum(main.qty_change).as_('balance_qty'),
-        fn.Sum(main.qty_change * main.in_out_rate).as_('balance_value'),
-        fn.Sum(Case().when(main.qty_change > 0, main.qty_change).else_(0)).as_('in_qty'),
-        fn.Sum(Case().when(main.qty_change > 0,
-                           main.qty_change * main.in_out_rate).else_(0)).as_('in_value'),
-        fn.Sum(Case().when(main.qty_change < 0, main.qty_change).else_(0)).as_('out_qty'),
-        fn.Sum(Case().when(main.qty_change < 0,
-                           main.qty_change * main.in_out_rate).else_(0)).as_('out_value'),
-        sub_query.as_('latest_valuation_rate')
-    ).where(Criterion.all(main_query_filters))
-            .groupby(main.item, main.warehouse))
+    # Number the entries of every (item, warehouse) group latest first, in the same pass that feeds the sums,
+    # so that the latest valuation rate is the one of row number 1
+    entries = (frappe.qb.from_(stock_ledger_entry).select(
+        stock_ledger_entry.item,
+        stock_ledger_entry.warehouse,
+        Case().when(stock_ledger_entry.qty_change > 0, stock_ledger_entry.qty_change).else_(0).as_('in_qty'),
+        Case().when(stock_ledger_entry.qty_change > 0,
+                    stock_ledger_entry.qty_change * stock_ledger_entry.in_out_rate).else_(0).as_('in_value'),
+        Case().when(stock_ledger_entry.qty_change < 0, stock_ledger_entry.qty_change).else_(0).as_('out_qty'),
+        Case().when(stock_ledger_entry.qty_change < 0,
+                    stock_ledger_entry.qty_change * stock_ledger_entry.in_out_rate).else_(0).as_('out_value'),
+        stock_ledger_entry.valuation_rate,
+        an.RowNumber().over(stock_ledger_entry.item, stock_ledger_entry.warehouse)
+        .orderby(stock_ledger_entry.posting_datetime, stock_ledger_entry.name, order=Order.desc).as_('row_number')
+    ).where(Criterion.all(query_filters)))
 
-    result = data.run(as_dict=True)
-    return stock_balance_report_columns, result
+    if closing:
+        # Snapshot rows come numbered 0, their rate is used only for groups without later entries
+        stock_closing_balance = frappe.qb.DocType("Stock Closing Balance")
+        snapshot_filters = [stock_closing_balance.stock_closing_entry == closing.name]
+        if "item" in filters:
+            snapshot_filters.append(stock_closing_balance.item == filters.get("item"))
+        if "warehouse" in filters:
+            snapshot_filters.append(
+                stock_closing_balance.warehouse.isin(get_descendants_query(filters.get("warehouse"))))
+        entries = entries.union_all(frappe.qb.from_(stock_closing_balance).select(
+            stock_closing_balance.item,
+            stock_closing_balance.warehouse,
+            stock_closing_balance.in_qty,
+            stock_closing_balance.in_value,
+            stock_closing_balance.out_qty,
+            stock_closing_balance.out_value,
+            stock_closing_balance.valuation_rate,
+            ValueWrapper(0)
+        ).where(Criterion.all(snapshot_filters)))
+
+    balances = (frappe.qb.from_(entries).select(
+        entries.item,
+        entries.warehouse,
+        fn.Sum(entries.in_qty + entries.out_qty).as_('balance_qty'),
+        fn.Sum(entries.in_value + entries.out_value).as_('balance_value'),
+        fn.Sum(entries.in_qty).as_('in_qty'),
+        fn.Sum(entries.in_value).as_('in_value'),
+        fn.Sum(entries.out_qty).as_('out_qty'),
+        fn.Sum(entries.out_value).as_('out_value'),
+        fn.Round(fn.Coalesce(fn.Max(Case().when(entries.row_number == 1, entries.valuation_rate)),
+                             fn.Max(Case().when(entries.row_number == 0, entries.valuation_rate))), 2)
+        .as_('latest_valuation_rate')
+    ).groupby(entries.item, entries.warehouse))
+    if not filters.get("group_subtotals"):
+        return balances
+
+    # Roll the balances up into every group warehouse above them in the same query, groups above the warehouse
+    # filter would only hold part of their stock and are left out
+    balances_cte = AliasedQuery("balances")
+    warehouse = frappe.qb.DocType("Warehouse")
+    group_warehouse = frappe.qb.DocType("Warehouse").as_("group_warehouse")
+    subtotals = (frappe.qb.from_(balances_cte)
+                 .join(warehouse).on(warehouse.name == balances_cte.warehouse)
+                 .join(group_warehouse).on((group_warehouse.lft < warehouse.lft)
+                                           & (group_warehouse.rgt > warehouse.rgt))
+                 .select(
+                     balances_cte.item,
+                     group_warehouse.name.as_('warehouse'),
+                     fn.Sum(balances_cte.balance_qty).as_('balance_qty'),
+                     fn.Sum(balances_cte.balance_value).as_('balance_value'),
+                     fn.Sum(balances_cte.in_qty).as_('in_qty'),
+                     fn.Sum(balances_cte.in_value).as_('in_value'),
+                     fn.Sum(balances_cte.out_qty).as_('out_qty'),
+                     fn.Sum(balances_cte.out_value).as_('out_value'),
+                     fn.Round(fn.Sum(balances_cte.balance_value) / fn.NullIf(fn.Sum(balances_cte.balance_qty), 0), 2)
+                     .as_('latest_valuation_rate'),
+                     ValueWrapper(1).as_('is_group')
+                 ).groupby(balances_cte.item, group_warehouse.name))
+    if "warehouse" in filters:
+        subtotals = subtotals.where(group_warehouse.name.isin(get_descendants_query(filters.get("warehouse"))))
+
+    rows = (frappe.qb.from_(balances_cte).select(
+        balances_cte.item,
+        balances_cte.warehouse,
+        balances_cte.balance_qty,
+        balances_cte.balance_value,
+        balances_cte.in_qty,
+        balances_cte.in_value,
+        balances_cte.out_qty,
+        balances_cte.out_value,
+        balances_cte.latest_valuation_rate,
+        ValueWrapper(0).as_('is_group')
+    ).union_all(subtotals))
+    return (frappe.qb.with_(balances, "balances").from_(rows).select("*")
+            .orderby(rows.item).orderby(rows.is_group).orderby(rows.warehouse))
@@ -1,3 +1,4 @@
+import frappe
 from frappe.tests.utils import FrappeTestCase
 from inventory_management.inventory_management.doctype.item.test_item import create_item
 from inventory_management.inventory_management.doctype.stock_entry.test_stock_entry import new_stock_entry
@@ -6,6 +7,8 @@ from inventory_management.inventory_management.doctype.warehouse.test_warehouse
 
 from inventory_management.inventory_management.report.stock_balance.stock_balance import \
 	execute as stock_balance_execute
+from inventory_management.inventory_management.report_cache import get_report_cache_stats
+from inventory_management.inventory_management.stock_ledger import get_stock_balances_as_of
 
 
 class TestStockBalanceReport(FrappeTestCase):
@@ -36,3 +39,49 @@ class TestStockBalanceReport(FrappeTestCase):
 		self.assertEqual(report[0].balance_qty, 5)  # 5 -2 + 2
 		self.assertEqual(report[0].balance_value, 3500)  # 500 * 5 + 1000 * 2 - 500 * 2
 		self.assertEqual(report[0].latest_valuation_rate, 700)  # FIFO > (500 * 5 + 1000 * 2) / 5
+
+	def test_group_warehouse(self):
+		update_valuation_method("FIFO")
+		region = create_warehouse("Test Region", is_group=True)
+		city = create_warehouse("Test City", region.name, is_group=True)
+		warehouse1 = create_warehouse("Test Warehouse 1", city.name)
+		warehouse2 = create_warehouse("Test Warehouse 2", region.name)
+		item = create_item("Test Item", warehouse1.name, 5, 500)
+		new_stock_entry("Receive", item.name, 5, "", warehouse2.name, 1000).save().submit()
+
+		# Filtering on a group warehouse lists the warehouses under it
+		report = stock_balance_execute(filters={"item": item.name, "warehouse": region.name})[1]
+		self.assertEqual(sorted(row.warehouse for row in report), sorted([warehouse1.name, warehouse2.name]))
+
+		# Subtotals of every group within the filter come after the rows of the item
+		report = stock_balance_execute(filters={"item": item.name, "warehouse": region.name,
+												"group_subtotals": 1})[1]
+		subtotals = {row.warehouse: row for row in report if row.is_group}
+		self.assertEqual(len(report), 4)
+		self.assertEqual(subtotals[region.name].balance_qty, 10)
+		self.assertEqual(subtotals[region.name].balance_value, 7500)
+		self.assertEqual(subtotals[region.name].latest_valuation_rate, 750)
+		self.assertEqual(subtotals[city.name].balance_qty, 5)
+
+		# Availability adds up the warehouses under the group too
+		balances = get_stock_balances_as_of([[item.name, region.name], [item.name, warehouse2.name]],
+											frappe.utils.now_datetime())
+		self.assertEqual(balances[0].qty, 10)
+		self.assertEqual(balances[0].stock_value, 7500)
+		self.assertEqual(balances[1].qty, 5)
+		self.assertEqual(balances[1].valuation_rate, 1000)
+
+	def test_report_cache(self):
+		warehouse = create_warehouse("Test Warehouse")
+		item = create_item("Test Item", warehouse.name, 5, 500)
+		filters = {"item": item.name, "warehouse": warehouse.name}
+		self.assertEqual(stock_balance_execute(filters)[1][0].balance_qty, 5)
+
+		# Same filters in another order are served from the cache
+		hits = get_report_cache_stats()["reports"]["Stock Balance"]["hits"]
+		self.assertEqual(stock_balance_execute({"warehouse": warehouse.name, "item": item.name})[1][0].balance_qty, 5)
+		self.assertEqual(get_report_cache_stats()["reports"]["Stock Balance"]["hits"], hits + 1)
+
+		# A ledger write leaves the cached result behind
+		new_stock_entry("Receive", item.name, 2, "", warehouse.name, 1000).submit()
+		self.assertEqual(stock_balance_execute(filters)[1][0].balance_qty, 7)
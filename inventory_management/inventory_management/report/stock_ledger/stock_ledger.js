@@ -53,6 +53,21 @@ frappe.query_reports["Stock Ledger"] = {
             "options": "Stock Entry"
         }
     ],
+    "onload": function (report) {
+        ["CSV", "Parquet"].forEach((file_format) => {
+            report.page.add_inner_button(file_format, () => {
+                frappe.call({
+                    method: "inventory_management.inventory_management.export.export_report",
+                    args: {
+                        report_name: "Stock Ledger",
+                        filters: report.get_values(),
+                        file_format: file_format
+                    },
+                    callback: () => frappe.show_alert("Export queued, a link will be shown once the file is ready")
+                });
+            }, "Export");
+        });
+    },
     "formatter": function (value, row, column, data, default_formatter) {
         value = default_formatter(value, row, column, data);
         if (column.fieldname === "qty_change") {
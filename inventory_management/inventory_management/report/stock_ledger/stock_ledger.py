@@ -1,11 +1,15 @@
 # Copyright (c) 2023, Tanmoy Sarkar and contributors
 # For license information, please see license.txt
 from pypika import Criterion
-from pypika.terms import AnalyticFunction as an
 
 import frappe
 from frappe import _
 from frappe.query_builder import functions as fn
+from frappe.utils import add_days, cint, getdate
+
+from inventory_management.inventory_management.doctype.stock_ledger_entry.stock_ledger_entry import \
+    get_posting_datetime
+from inventory_management.inventory_management.report_cache import get_cached_result
 
 stock_ledger_report_columns = [
     {
@@ -71,65 +75,85 @@ stock_ledger_report_columns = [
 ]
 
 
+MAX_PAGE_LENGTH = 5000
+
+
 def execute(filters=None):
     if not filters:
         filters = {}
-    subquery_filters = []
-    main_query_filter = []
+    result = get_cached_result("Stock Ledger", filters, lambda: get_query(filters).run(as_dict=True))
+    return stock_ledger_report_columns, result
+
+
+@frappe.whitelist()
+def get_page(filters=None, after=None, page_length=500):
+    # Return the page of the report that follows the (posting_datetime, name) cursor of the previous page
+    # Memory stays bounded by page_length whatever the size of the ledger
+    frappe.has_permission('Stock Ledger Entry', 'read', throw=True)
+    filters = frappe.parse_json(filters) or {}
+    after = frappe.parse_json(after)
+    page_length = min(cint(page_length) or 500, MAX_PAGE_LENGTH)
+
+    stock_ledger_entry = frappe.qb.DocType('Stock Ledger Entry')
+    query = get_query(filters)
+    if after:
+        posting_datetime, name = after
+        # Seek past the cursor, written out so that it can use the posting index
+        query = query.where(
+            (stock_ledger_entry.posting_datetime > posting_datetime)
+            | ((stock_ledger_entry.posting_datetime == posting_datetime) & (stock_ledger_entry.name > name))
+        )
+    data = query.limit(page_length).run(as_dict=True)
+
+    next_cursor = None
+    if len(data) == page_length:
+        next_cursor = [data[-1].posting_datetime, data[-1].name]
+    return {'columns': stock_ledger_report_columns, 'data': data, 'next_cursor': next_cursor}
+
+
+def get_query(filters):
+    query_filters = []
     stock_ledger_entry = frappe.qb.DocType('Stock Ledger Entry')
 
     if filters.get('item', ''):
-        subquery_filters.append(stock_ledger_entry.item == filters.get('item', ''))
+        query_filters.append(stock_ledger_entry.item == filters.get('item', ''))
     if filters.get('warehouse', ''):
-        subquery_filters.append(stock_ledger_entry.warehouse == filters.get('warehouse', ''))
+        query_filters.append(stock_ledger_entry.warehouse == filters.get('warehouse', ''))
+    if filters.get('from_date', ''):
+        query_filters.append(stock_ledger_entry.posting_datetime >= getdate(filters.get('from_date', '')))
+    if filters.get('to_date', ''):
+        query_filters.append(stock_ledger_entry.posting_datetime < add_days(filters.get('to_date', ''), 1))
     if filters.get('posting_date', ''):
-        subquery_filters.append(stock_ledger_entry.posting_date >= filters.get('posting_date', ''))
-    if filters.get('posting_time', ''):
-        subquery_filters.append(stock_ledger_entry.posting_time >= filters.get('posting_time', ''))
+        # posting time only narrows the start on the posting date itself
+        query_filters.append(stock_ledger_entry.posting_datetime >= get_posting_datetime(
+            filters.get('posting_date', ''), filters.get('posting_time', '') or '00:00:00'))
 
     if filters.get('type', '') == 'Receive':
-        subquery_filters.append(stock_ledger_entry.qty_change > 0)
+        query_filters.append(stock_ledger_entry.qty_change > 0)
     elif filters.get('type', '') == 'Consume':
-        subquery_filters.append(stock_ledger_entry.qty_change < 0)
+        query_filters.append(stock_ledger_entry.qty_change < 0)
 
     if filters.get('stock_entry', ''):
-        subquery_filters.append(stock_ledger_entry.stock_entry == filters.get('stock_entry', ''))
+        query_filters.append(stock_ledger_entry.stock_entry == filters.get('stock_entry', ''))
 
-    item_warehouse_subquery = (
+    # Running balances are stored on every ledger entry, so this is a plain range scan
+    return (
         frappe.qb.from_(stock_ledger_entry)
         .select(
+            stock_ledger_entry.name,
             stock_ledger_entry.item,
             stock_ledger_entry.warehouse,
             stock_ledger_entry.qty_change,
             stock_ledger_entry.in_out_rate,
-            stock_ledger_entry.valuation_rate,
             stock_ledger_entry.posting_date,
             stock_ledger_entry.posting_time,
-            (stock_ledger_entry.qty_change * stock_ledger_entry.valuation_rate).as_('value_change'),
-            an("SUM", stock_ledger_entry.qty_change).over(stock_ledger_entry.item,
-                                                          stock_ledger_entry.warehouse).orderby(
-                stock_ledger_entry.posting_date, stock_ledger_entry.posting_time).as_('balance_qty'),
-            an("SUM", stock_ledger_entry.qty_change * stock_ledger_entry.valuation_rate).over(stock_ledger_entry.item,
-                                                                                              stock_ledger_entry.warehouse).orderby(
-                stock_ledger_entry.posting_date, stock_ledger_entry.posting_time).as_('balance_value'),
+            stock_ledger_entry.posting_datetime,
+            stock_ledger_entry.qty_after_transaction.as_('balance_qty'),
+            fn.Round(stock_ledger_entry.valuation_rate, 2).as_('valuation_rate'),
+            fn.Round(stock_ledger_entry.stock_value_difference, 2).as_('value_change'),
+            fn.Round(stock_ledger_entry.stock_value_after_transaction, 2).as_('balance_value'),
             stock_ledger_entry.stock_entry
-        ).where(Criterion.all(subquery_filters))
-    )
-    stock_entry_with_calculations = (frappe.qb.from_(item_warehouse_subquery)
-                                     .select('*',
-                                             (item_warehouse_subquery.value_change + fn.Coalesce(
-                                                 an('LAG', item_warehouse_subquery.balance_value, 1)
-                                                 .over(item_warehouse_subquery.item, item_warehouse_subquery.warehouse)
-                                                 .orderby(item_warehouse_subquery.posting_date,
-                                                          item_warehouse_subquery.posting_time), 0)
-                                              ).as_('updated_balance_value')))
-    data = (
-        frappe.qb.from_(stock_entry_with_calculations)
-        .select('*',
-                fn.Round(stock_entry_with_calculations.updated_balance_value, 2).as_('balance_value'),
-                fn.Round(stock_entry_with_calculations.valuation_rate, 2).as_('valuation_rate'),
-                fn.Round(stock_entry_with_calculations.value_change, 2).as_('value_change'))
-        .where(Criterion.all(main_query_filter))
+        ).where(Criterion.all(query_filters))
+        .orderby(stock_ledger_entry.posting_datetime)
+        .orderby(stock_ledger_entry.name)
     )
-    result = data.run(as_dict=True)
-    return stock_ledger_report_columns, result
@@ -1,10 +1,15 @@
+import csv
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 from inventory_management.inventory_management.doctype.item.test_item import create_item
 from inventory_management.inventory_management.doctype.stock_entry.test_stock_entry import new_stock_entry
 from inventory_management.inventory_management.doctype.stock_settings.test_stock_settings import update_valuation_method
 from inventory_management.inventory_management.doctype.warehouse.test_warehouse import create_warehouse
+from inventory_management.inventory_management.export import write_report_file
 
-from inventory_management.inventory_management.report.stock_ledger.stock_ledger import execute as stock_ledger_execute
+from inventory_management.inventory_management.report.stock_ledger.stock_ledger import execute as stock_ledger_execute, \
+	get_page as stock_ledger_get_page
 
 
 class TestStockLedgerReport(FrappeTestCase):
@@ -35,7 +40,7 @@ class TestStockLedgerReport(FrappeTestCase):
 		self.assertEqual(int(first_entry.in_out_rate), 500)
 		self.assertEqual(int(first_entry.valuation_rate), 500)
 		self.assertEqual(int(first_entry.value_change), 2500)
-		self.assertEqual(int(first_entry.updated_balance_value), 2500)
+		self.assertEqual(int(first_entry.balance_value), 2500)
 		# Check second ledger entry -- while consuming stock
 		second_entry = report[1]
 		self.assertEqual(second_entry.qty_change, -2)
@@ -43,12 +48,66 @@ class TestStockLedgerReport(FrappeTestCase):
 		self.assertEqual(int(second_entry.in_out_rate), 500)
 		self.assertEqual(int(second_entry.valuation_rate), 500)
 		self.assertEqual(int(second_entry.value_change), -1000)
-		self.assertEqual(int(second_entry.updated_balance_value), 1500)
+		self.assertEqual(int(second_entry.balance_value), 1500)
 		# Check third ledger entry -- while receiving stock
 		third_entry = report[2]
 		self.assertEqual(third_entry.qty_change, 2)
 		self.assertEqual(int(third_entry.balance_qty), 5)
 		self.assertEqual(int(third_entry.in_out_rate), 1000)
 		self.assertEqual(int(third_entry.valuation_rate), 700)
-		self.assertEqual(int(third_entry.value_change), 1400)
-		self.assertEqual(int(third_entry.updated_balance_value), 2900)
+		self.assertEqual(int(third_entry.value_change), 2000)
+		self.assertEqual(int(third_entry.balance_value), 3500)
+
+	def test_paginated_report(self):
+		warehouse = create_warehouse("Test Warehouse")
+		item = create_item("Test Item", warehouse.name, 5, 500)
+		for _ in range(4):
+			new_stock_entry("Receive", item.name, 1, "", warehouse.name, 1000).save().submit()
+		filters = {"item": item.name, "warehouse": warehouse.name}
+
+		# Walk the report two rows at a time
+		pages, cursor = [], None
+		while True:
+			page = stock_ledger_get_page(filters, after=cursor, page_length=2)
+			pages.append(page["data"])
+			cursor = page["next_cursor"]
+			if not cursor:
+				break
+
+		# Check if pages add up to the full report, in the same order
+		full_report = stock_ledger_execute(filters)[1]
+		self.assertEqual([row.name for page in pages for row in page], [row.name for row in full_report])
+		self.assertEqual([row.balance_qty for page in pages for row in page], [5, 6, 7, 8, 9])
+
+	def test_csv_export(self):
+		warehouse = create_warehouse("Test Warehouse")
+		item = create_item("Test Item", warehouse.name, 5, 500)
+		new_stock_entry("Consume", item.name, 2, warehouse.name, "", 500).save().submit()
+
+		file_url = write_report_file("Stock Ledger", {"item": item.name, "warehouse": warehouse.name}, "CSV")
+		with open(frappe.get_site_path(file_url.lstrip("/"))) as f:
+			rows = list(csv.DictReader(f))
+
+		# Check if the export holds the same rows as the report
+		self.assertEqual([int(row["qty_change"]) for row in rows], [5, -2])
+		self.assertEqual([int(row["balance_qty"]) for row in rows], [5, 3])
+
+	def test_posting_time_filter_applies_to_posting_date_only(self):
+		warehouse = create_warehouse("Test Warehouse")
+		item = create_item("Test Item", warehouse.name, 5, 500)
+
+		# Entries of later dates are listed whatever their time of day
+		report = stock_ledger_execute(filters={
+			"item": item.name,
+			"posting_date": frappe.utils.add_days(frappe.utils.nowdate(), -1),
+			"posting_time": "23:59:59"
+		})[1]
+		self.assertEqual(len(report), 1)
+
+		# Same date, time later than the posting
+		report = stock_ledger_execute(filters={
+			"item": item.name,
+			"posting_date": frappe.utils.add_days(frappe.utils.nowdate(), 1),
+			"posting_time": "00:00:00"
+		})[1]
+		self.assertEqual(len(report), 0)
@@ -0,0 +1,73 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import hashlib
+import json
+
+import frappe
+
+LEDGER_VERSION_KEY = "stock_ledger_version"
+REPORT_CACHE_KEY = "stock_report_result"
+REPORT_CACHE_STATS_KEY = "stock_report_cache_stats"
+CACHED_REPORTS = ("Stock Balance", "Stock Ledger")
+REPORT_CACHE_TTL = 60 * 60
+# larger results are recomputed every time rather than held in redis
+MAX_CACHED_ROWS = 10000
+
+
+def get_cached_result(report_name: str, filters: dict, get_result) -> list:
+	# Result of a stock report for filters, computed by get_result only when the ledger changed since it was cached
+	# The key holds the ledger version, so that every ledger write leaves the cached results behind to expire
+	cache = frappe.cache()
+	key = "{}::{}::{}".format(REPORT_CACHE_KEY, get_ledger_version(), _get_filters_hash(report_name, filters))
+	result = cache.get_value(key)
+	if result is not None:
+		cache.incr(_get_stats_key(report_name, "hits"))
+		return result
+
+	cache.incr(_get_stats_key(report_name, "misses"))
+	result = get_result()
+	if len(result) <= MAX_CACHED_ROWS:
+		cache.set_value(key, result, expires_in_sec=REPORT_CACHE_TTL)
+	return result
+
+
+def get_ledger_version() -> int:
+	return frappe.utils.cint(frappe.cache().get(frappe.cache().make_key(LEDGER_VERSION_KEY)))
+
+
+def bump_ledger_version():
+	# Called whenever ledger entries are written or reposted, or anything else the reports depend on changes
+	# Bumped again once the transaction is committed, so that a report racing the write does not cache a result
+	# read before the commit under the new version
+	_incr_ledger_version()
+	frappe.db.after_commit.add(_incr_ledger_version)
+
+
+@frappe.whitelist()
+def get_report_cache_stats() -> dict:
+	# Hits and misses of the report cache per report, along with the current ledger version
+	frappe.only_for("System Manager")
+	cache = frappe.cache()
+	stats = {}
+	for report_name in CACHED_REPORTS:
+		hits, misses = (frappe.utils.cint(cache.get(_get_stats_key(report_name, metric)))
+						for metric in ("hits", "misses"))
+		stats[report_name] = {"hits": hits, "misses": misses,
+							  "hit_ratio": hits / (hits + misses) if hits + misses else 0}
+	return {"ledger_version": get_ledger_version(), "reports": stats}
+
+
+def _incr_ledger_version():
+	frappe.cache().incr(frappe.cache().make_key(LEDGER_VERSION_KEY))
+
+
+def _get_stats_key(report_name: str, metric: str):
+	# plain counters, incremented atomically by every worker
+	return frappe.cache().make_key("{}::{}::{}".format(REPORT_CACHE_STATS_KEY, report_name, metric))
+
+
+def _get_filters_hash(report_name: str, filters: dict) -> str:
+	# Same filters in another order or given as other types, such as dates or numbers as strings, share the key
+	filters = {key: str(value) for key, value in (filters or {}).items() if value is not None}
+	return hashlib.sha256(json.dumps([report_name, filters], sort_keys=True).encode()).hexdigest()
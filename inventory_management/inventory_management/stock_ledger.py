@@ -0,0 +1,225 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import os
+import threading
+import time
+from functools import reduce
+
+import frappe
+from frappe.query_builder import Order
+
+from inventory_management.inventory_management.doctype.stock_closing_entry.stock_closing_entry import \
+	validate_posting_date
+from inventory_management.inventory_management.doctype.warehouse.warehouse import get_descendant_warehouses
+from inventory_management.inventory_management.report_cache import bump_ledger_version
+
+AS_OF_CHUNK_SIZE = 500
+MAX_NAME_SEQUENCE = 0xffffff
+VALUATION_RATE_CACHE_KEY = "stock_valuation_rate"
+
+# last time ordered name made by this process, see make_time_ordered_names
+_name_lock = threading.Lock()
+_name_state = {"pid": None}
+
+
+def make_sl_entries(sl_entries: list) -> list:
+	# Write many Stock Ledger Entries with a single multi-row insert
+	if not sl_entries:
+		return []
+
+	docs = [frappe.get_doc(dict(sl_entry, doctype="Stock Ledger Entry")) for sl_entry in sl_entries]
+	validate_posting_date(min(frappe.utils.getdate(doc.posting_date) for doc in docs))
+	validate_links(docs, (("Item", "item"), ("Warehouse", "warehouse")))
+	bulk_insert_docs(docs, get_ledger_names(len(docs), "SLE-", "SLE-{:05d}"))
+	clear_valuation_rate_cache({(doc.item, doc.warehouse) for doc in docs})
+	bump_ledger_version()
+	return docs
+
+
+def bulk_insert_docs(docs: list, names: list):
+	# Insert new documents of one doctype with a single multi-row insert, named by names allocated in one go
+	# (see reserve_names and make_time_ordered_names)
+	# Controller methods and doc_events hooks still run for every document, but without the per-document
+	# insert lifecycle (permission checks, link lookups, naming series lock and INSERT per row)
+	now = frappe.utils.now()
+	for doc, name in zip(docs, names):
+		doc._set_defaults()
+		doc.name = name
+		doc.owner = doc.modified_by = frappe.session.user
+		doc.creation = doc.modified = now
+		doc.docstatus = 0
+		doc.idx = 0
+		doc.run_method("before_insert")
+		doc.run_method("validate")
+		doc.run_method("before_save")
+		doc._validate_mandatory()
+
+	rows = [doc.get_valid_dict(convert_dates_to_str=True, ignore_virtual=True) for doc in docs]
+	fields = list(rows[0])
+	frappe.db.bulk_insert(docs[0].doctype, fields, [[row[field] for field in fields] for row in rows])
+
+	for doc in docs:
+		doc.run_method("after_insert")
+		doc.run_method("on_update")
+
+
+def validate_links(docs: list, links: tuple):
+	# Check every linked document exists with one query per linked doctype, links are (doctype, fieldname) pairs
+	for link_doctype, fieldname in links:
+		values = {doc.get(fieldname) for doc in docs if doc.get(fieldname)}
+		existing = set(frappe.get_all(link_doctype, filters={"name": ["in", list(values)]}, pluck="name"))
+		missing = values - existing
+		if missing:
+			frappe.throw("Could not find {}: {}".format(link_doctype, ", ".join(sorted(missing))),
+						 frappe.LinkValidationError)
+
+
+def reserve_names(count: int, name_format: str) -> list:
+	# Reserve `count` consecutive numbers of a `format:` autoname series under a single row lock
+	# `{#####}` in a format autoname counts on the series without prefix, name_format turns a number into a name
+	series = frappe.qb.DocType("Series")
+	current = (frappe.qb.from_(series)
+			   .select(series.current)
+			   .where(series.name == "")
+			   .for_update()
+			   .run())
+	if current and current[0][0] is not None:
+		start = frappe.utils.cint(current[0][0]) + 1
+		frappe.qb.update(series).set(series.current, series.current + count).where(series.name == "").run()
+	else:
+		start = 1
+		frappe.qb.into(series).columns(series.name, series.current).insert("", count).run()
+	return [name_format.format(number) for number in range(start, start + count)]
+
+
+def get_ledger_names(count: int, prefix: str, name_format: str) -> list:
+	# Names for `count` new Stock Entries or ledger entries as set in Stock Settings, `prefix` for time ordered
+	# names and `name_format` for names out of the naming series, see reserve_names
+	if uses_time_ordered_names():
+		return make_time_ordered_names(count, prefix)
+	return reserve_names(count, name_format)
+
+
+def uses_time_ordered_names() -> bool:
+	# Sites that never saved the setting get its default
+	return frappe.db.get_single_value("Stock Settings", "ledger_naming") != "Series"
+
+
+def make_time_ordered_names(count: int, prefix: str) -> list:
+	# `count` unique names without any database lock, a whole range allocated at once
+	# Milliseconds since the epoch and a sequence within the millisecond, then a random part telling the process
+	# apart, so that names made by one process always sort in the order they were made and concurrent processes
+	# never collide nor wait on each other
+	# The T after the prefix sorts them after every name of the naming series, digits only, name breaks ties of
+	# entries posted at the same time in reposts, cancels and paging
+	state = _name_state
+	with _name_lock:
+		if state["pid"] != os.getpid():
+			# new process, forked ones included
+			state.update(pid=os.getpid(), time=0, sequence=-1, process_part=os.urandom(4).hex())
+		timestamp = int(time.time() * 1000)
+		if timestamp > state["time"]:
+			state.update(time=timestamp, sequence=-1)
+		if state["sequence"] + count > MAX_NAME_SEQUENCE:
+			# sequence of this millisecond used up, borrow the next one
+			state.update(time=state["time"] + 1, sequence=-1)
+		timestamp, start = state["time"], state["sequence"] + 1
+		state["sequence"] += count
+	return ["{}T{:012x}{:06x}{}".format(prefix, timestamp, sequence, state["process_part"])
+			for sequence in range(start, start + count)]
+
+
+@frappe.whitelist()
+def get_stock_balances_as_of(pairs, posting_datetime) -> list:
+	# Qty, value and rate of every (item, warehouse) pair at posting_datetime, in the order of pairs
+	# Each pair is answered by the running balances of its latest ledger entry up to then, looked up with one
+	# index seek per pair, so that the cost grows with the number of pairs and not with the size of the ledger
+	# A group warehouse adds up the balances of every warehouse under it
+	frappe.has_permission("Stock Ledger Entry", "read", throw=True)
+	pairs = [tuple(pair) for pair in frappe.parse_json(pairs) or []]
+	posting_datetime = frappe.utils.get_datetime(posting_datetime)
+	descendants = get_descendant_warehouses({warehouse for _, warehouse in pairs})
+
+	balances = {}
+	unique_pairs = list(dict.fromkeys((item, descendant) for item, warehouse in pairs
+									  for descendant in descendants[warehouse]))
+	for start in range(0, len(unique_pairs), AS_OF_CHUNK_SIZE):
+		for row in get_latest_entries(unique_pairs[start:start + AS_OF_CHUNK_SIZE], posting_datetime):
+			balances[(row.item, row.warehouse)] = row
+
+	result = []
+	for item, warehouse in pairs:
+		rows = [balances[(item, descendant)] for descendant in descendants[warehouse]
+				if (item, descendant) in balances]
+		qty = sum(row.qty_after_transaction or 0 for row in rows)
+		stock_value = sum(row.stock_value_after_transaction or 0 for row in rows)
+		if len(rows) == 1:
+			valuation_rate = rows[0].valuation_rate or 0
+		else:
+			valuation_rate = stock_value / qty if qty > 0 else 0
+		result.append(frappe._dict(
+			item=item,
+			warehouse=warehouse,
+			qty=qty,
+			stock_value=stock_value,
+			valuation_rate=valuation_rate,
+		))
+	return result
+
+
+def get_latest_entries(pairs: list, posting_datetime) -> list:
+	# One `ORDER BY ... DESC LIMIT 1` per pair on the (item, warehouse, posting_datetime) index,
+	# glued into a single UNION ALL
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	queries = [
+		frappe.qb.from_(doctype)
+		.select(doctype.item, doctype.warehouse, doctype.qty_after_transaction,
+				doctype.stock_value_after_transaction, doctype.valuation_rate)
+		.where(doctype.item == item)
+		.where(doctype.warehouse == warehouse)
+		.where(doctype.posting_datetime <= posting_datetime)
+		.orderby(doctype.posting_datetime, order=Order.desc)
+		.orderby(doctype.name, order=Order.desc)
+		.limit(1)
+		for item, warehouse in pairs
+	]
+	return reduce(lambda union, query: union.union_all(query), queries).run(as_dict=True)
+
+
+def get_valuation_rates(pairs: list) -> dict:
+	# Latest valuation rate of every (item, warehouse) pair by posting date and time, keyed by the pair
+	# Rates come from the cache, the missing ones are read with a single query and cached
+	pairs = list(dict.fromkeys(tuple(pair) for pair in pairs))
+	cache = frappe.cache()
+	rates = {}
+	for pair in pairs:
+		rate = cache.hget(VALUATION_RATE_CACHE_KEY, _get_cache_field(*pair))
+		if rate is not None:
+			rates[pair] = rate
+
+	missing = [pair for pair in pairs if pair not in rates]
+	if missing:
+		now = frappe.utils.now_datetime()
+		latest = {}
+		for start in range(0, len(missing), AS_OF_CHUNK_SIZE):
+			for row in get_latest_entries(missing[start:start + AS_OF_CHUNK_SIZE], now):
+				latest[(row.item, row.warehouse)] = row.valuation_rate or 0
+		for pair in missing:
+			rates[pair] = latest.get(pair, 0)
+			cache.hset(VALUATION_RATE_CACHE_KEY, _get_cache_field(*pair), rates[pair])
+	return rates
+
+
+def clear_valuation_rate_cache(pairs):
+	# Called whenever ledger entries of the bins are written or reposted
+	# Cleared again once the transaction is committed, so that a read racing the write does not keep a stale rate
+	fields = [_get_cache_field(item, warehouse) for item, warehouse in pairs]
+	if not fields:
+		return
+	frappe.cache().hdel(VALUATION_RATE_CACHE_KEY, fields)
+	frappe.db.after_commit.add(lambda: frappe.cache().hdel(VALUATION_RATE_CACHE_KEY, fields))
+
+
+def _get_cache_field(item: str, warehouse: str) -> str:
+	return "{}::{}".format(item, warehouse)
@@ -0,0 +1,104 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import frappe
+
+from inventory_management.inventory_management.doctype.bin.bin import lock_bins
+
+MAX_BATCH_SIZE = 1000
+
+
+@frappe.whitelist(methods=["POST"])
+def post_stock_entries(entries) -> list:
+	# Post a batch of Stock Entries sent by an external system, all or none of them, in a single transaction
+	# Every entry holds the Stock Entry fields, its items and a client `idempotency_key`, an entry whose key has
+	# been posted before is answered with the existing Stock Entry, so that a retried batch never posts twice
+	# Returns the result of every entry, in the order of entries
+	frappe.has_permission("Stock Entry", "create", throw=True)
+	frappe.has_permission("Stock Entry", "submit", throw=True)
+	entries = frappe.parse_json(entries) or []
+	if len(entries) > MAX_BATCH_SIZE:
+		frappe.throw("At most {} entries can be posted at once".format(MAX_BATCH_SIZE))
+	keys = [entry.get("idempotency_key") for entry in entries]
+	if not all(keys):
+		frappe.throw("Every entry needs an idempotency_key")
+	if len(set(keys)) != len(keys):
+		frappe.throw("Idempotency keys must be unique within a batch")
+
+	docs = [_get_stock_entry(entry) for entry in entries]
+
+	# Lock every bin of the batch up front in one go and in one order, so that concurrent batches can't deadlock
+	# Pairs of unknown items or warehouses are left to fail the link validation of their entry
+	pairs = list(dict.fromkeys(pair for doc in docs for pair in doc.get_bin_pairs()))
+	items = set(frappe.get_all("Item", filters={"name": ["in", [item for item, _ in pairs]]}, pluck="name"))
+	warehouses = set(frappe.get_all("Warehouse", filters={"name": ["in", [warehouse for _, warehouse in pairs]]},
+									pluck="name"))
+	lock_bins([(item, warehouse) for item, warehouse in pairs if item in items and warehouse in warehouses])
+
+	# A plain read, keys being posted by a concurrent batch meanwhile are left to the unique idempotency key
+	# Locking keys that don't exist yet would gap lock the index, concurrent batches would then deadlock on insert
+	posted = _get_posted(keys)
+	results = [frappe._dict(idempotency_key=key, status="Already Posted", stock_entry=posted[key])
+			   if key in posted else frappe._dict(idempotency_key=key) for key in keys]
+	docs = [doc for doc in docs if doc.idempotency_key not in posted]
+	if not docs:
+		return results
+
+	# Entries are then validated and posted one after another, each sees the stock left by the ones before it
+	frappe.db.savepoint("stock_posting")
+	errors = {}
+	for doc in docs:
+		frappe.db.savepoint("stock_posting_entry")
+		try:
+			doc.insert()
+			doc.submit()
+		except frappe.QueryDeadlockError:
+			# the database rolled back the whole transaction, savepoints included
+			raise
+		except Exception as e:
+			frappe.db.rollback(save_point="stock_posting_entry")
+			# the key was posted by a concurrent batch after the lookup above
+			if isinstance(e, frappe.UniqueValidationError):
+				posted.update(_get_posted_entry(doc.idempotency_key))
+			if doc.idempotency_key not in posted:
+				errors[doc.idempotency_key] = str(e) or type(e).__name__
+	if errors:
+		frappe.db.rollback(save_point="stock_posting")
+	# keep the messages of the failed entries, and of the ones posted meanwhile, out of the response popups
+	frappe.clear_messages()
+
+	names = {doc.idempotency_key: doc.name for doc in docs}
+	for result in results:
+		if result.status:
+			continue
+		if result.idempotency_key in posted:
+			result.update(status="Already Posted", stock_entry=posted[result.idempotency_key])
+		elif result.idempotency_key in errors:
+			result.update(status="Failed", error=errors[result.idempotency_key])
+		elif errors:
+			result.status = "Not Posted"
+		else:
+			result.update(status="Posted", stock_entry=names[result.idempotency_key])
+	return results
+
+
+def _get_posted(keys: list) -> dict:
+	return dict(frappe.get_all("Stock Entry", filters={"idempotency_key": ["in", keys]},
+							   fields=["idempotency_key", "name"], as_list=True))
+
+
+def _get_posted_entry(key: str) -> dict:
+	# A locking read, it sees the entry committed after the snapshot of this transaction, its row exists so
+	# only the row is locked
+	name = frappe.db.get_value("Stock Entry", {"idempotency_key": key}, "name", for_update=True)
+	return {key: name} if name else {}
+
+
+def _get_stock_entry(entry: dict):
+	doc = frappe.get_doc(dict(entry, doctype="Stock Entry", docstatus=0))
+	if not doc.date:
+		doc.date = frappe.utils.nowdate()
+	if not doc.time:
+		doc.time = frappe.utils.nowtime()
+	doc.flags.in_bulk_posting = True
+	return doc
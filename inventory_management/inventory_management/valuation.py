@@ -0,0 +1,231 @@
+# Copyright (c) 2026, Tanmoy Sarkar and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+
+from inventory_management.inventory_management.doctype.bin.bin import get_bins_details, lock_bins, update_bin
+
+
+class FIFOValuation:
+	# Stock of an item in a warehouse as a queue of [qty, rate] layers, oldest first
+	# A single layer with negative qty stands for stock that went below zero
+
+	def __init__(self, queue: list = None):
+		self.queue = [[qty, rate] for qty, rate in (queue or [])]
+		self.qty = sum(qty for qty, _ in self.queue)
+		self.value = sum(qty * rate for qty, rate in self.queue)
+
+	@classmethod
+	def from_json(cls, queue: str) -> "FIFOValuation":
+		return cls(json.loads(queue) if queue else [])
+
+	def to_json(self) -> str:
+		return json.dumps(self.queue)
+
+	@property
+	def valuation_rate(self) -> float:
+		if self.qty > 0:
+			return self.value / self.qty
+		# no stock left, value whatever comes next at the last known rate
+		return self.queue[-1][1] if self.queue else 0
+
+	def add_stock(self, qty: int, rate: float):
+		self.qty += qty
+		if self.queue and self.queue[-1][0] < 0:
+			# receipt first covers the stock that went below zero, what is left is valued at the receipt rate
+			negative_qty, negative_rate = self.queue.pop()
+			qty += negative_qty
+			self.value = 0
+			if qty <= 0:
+				# still below zero, at the rate it went there
+				if qty:
+					self.queue.append([qty, negative_rate])
+				self.value = qty * negative_rate
+				return
+		self.value += qty * rate
+		if self.queue and self.queue[-1][1] == rate:
+			# keep the queue compact by merging receipts at the same rate
+			self.queue[-1][0] += qty
+		else:
+			self.queue.append([qty, rate])
+
+	def remove_stock(self, qty: int, rate: float = 0) -> float:
+		# Pop layers from the front, returns the value of the stock taken out
+		# rate values stock taken out of an empty queue, the last known valuation rate of the bin
+		self.qty -= qty
+		consumed_value = 0
+		last_rate = self.queue[0][1] if self.queue else rate
+		while qty and self.queue and self.queue[0][0] > 0:
+			layer = self.queue[0]
+			last_rate = layer[1]
+			taken = min(qty, layer[0])
+			consumed_value += taken * layer[1]
+			layer[0] -= taken
+			qty -= taken
+			if layer[0] == 0:
+				self.queue.pop(0)
+		if qty:
+			# not enough stock, carry the rest as a negative layer at the last rate
+			consumed_value += qty * last_rate
+			if self.queue:
+				self.queue[0][0] -= qty
+			else:
+				self.queue.append([-qty, last_rate])
+		self.value -= consumed_value
+		return consumed_value
+
+	def return_received_stock(self, qty: int, rate: float):
+		# Take back stock that was received at rate, out of the newest layers at that rate first
+		self.qty -= qty
+		for layer in reversed(self.queue):
+			if not qty:
+				break
+			if layer[0] > 0 and layer[1] == rate:
+				taken = min(qty, layer[0])
+				layer[0] -= taken
+				qty -= taken
+				self.value -= taken * rate
+		# part of it has been consumed since, take the rest out of the newest layers
+		while qty and self.queue and self.queue[-1][0] > 0:
+			layer = self.queue[-1]
+			taken = min(qty, layer[0])
+			layer[0] -= taken
+			qty -= taken
+			self.value -= taken * layer[1]
+			if layer[0] == 0:
+				self.queue.pop()
+		self.queue = [layer for layer in self.queue if layer[0]]
+		if qty:
+			self.value -= qty * rate
+			if self.queue and self.queue[-1][0] < 0:
+				self.queue[-1][0] -= qty
+			else:
+				self.queue.append([-qty, rate])
+
+	def return_consumed_stock(self, qty: int, rate: float):
+		# Put consumed stock back in front of the queue, where it was taken from
+		if self.queue and self.queue[-1][0] < 0:
+			# stock went below zero meanwhile, cover that first like any receipt
+			self.add_stock(qty, rate)
+			return
+		self.qty += qty
+		self.value += qty * rate
+		if self.queue and self.queue[0][1] == rate:
+			self.queue[0][0] += qty
+		else:
+			self.queue.insert(0, [qty, rate])
+
+
+# previous holds actual_qty, stock_value, valuation_rate and fifo_queue of the bin before the change
+# If received, qty_change is positive, else negative
+# Returns valuation rate after the change along with the change in stock value, the FIFO queue to store
+# and the running balances after the change
+def value_stock_change(previous: dict, qty_change: int, rate: float, valuation_method: str,
+					   is_consumed: bool = False) -> frappe._dict:
+	valuation_rate = 0
+	# FIFO queue is kept whatever the valuation method, so that switching to FIFO starts from the right layers
+	fifo = FIFOValuation.from_json(previous.fifo_queue)
+	value_before = fifo.value
+	if qty_change > 0:
+		fifo.add_stock(qty_change, rate)
+	elif qty_change < 0:
+		fifo.remove_stock(-qty_change, previous.valuation_rate)
+	value_change = qty_change * rate
+	if valuation_method == "FIFO":
+		# Stock value follows the queue, also when a receipt covers stock that went below zero
+		value_change = fifo.value - value_before
+
+	if valuation_method == "FIFO":
+		valuation_rate = max(fifo.valuation_rate, 0)
+	elif valuation_method == "Moving Average":
+		# Weighted average of the stock already held at its valuation rate and the incoming stock,
+		# issues leave the rate unchanged
+		valuation_rate = previous.valuation_rate
+		if qty_change > 0:
+			if previous.actual_qty > 0:
+				valuation_rate = ((previous.actual_qty * previous.valuation_rate + qty_change * rate)
+								  / (previous.actual_qty + qty_change))
+			else:
+				valuation_rate = rate
+		# Keep stock value equal to qty * rate
+		value_change = (previous.actual_qty + qty_change) * valuation_rate - previous.stock_value
+
+	if valuation_rate == 0:
+		valuation_rate = 0 if is_consumed else rate
+	return frappe._dict(valuation_rate=valuation_rate, value_change=value_change, fifo_queue=fifo.to_json(),
+						qty_after_transaction=previous.actual_qty + qty_change,
+						stock_value_after_transaction=previous.stock_value + value_change)
+
+
+# Undo a ledger entry of qty_change that changed stock value by value_change, previous as in value_stock_change
+# Stock value goes back by exactly value_change, returns the same as value_stock_change
+def reverse_stock_change(previous: dict, qty_change: int, value_change: float, in_out_rate: float,
+						 valuation_method: str) -> frappe._dict:
+	fifo = FIFOValuation.from_json(previous.fifo_queue)
+	if qty_change > 0:
+		fifo.return_received_stock(qty_change, in_out_rate)
+	elif qty_change < 0:
+		fifo.return_consumed_stock(-qty_change, value_change / qty_change)
+
+	qty_after_transaction = previous.actual_qty - qty_change
+	stock_value_after_transaction = previous.stock_value - value_change
+	if valuation_method == "FIFO":
+		valuation_rate = max(fifo.valuation_rate, 0)
+	elif qty_after_transaction > 0:
+		valuation_rate = stock_value_after_transaction / qty_after_transaction
+	else:
+		valuation_rate = previous.valuation_rate
+	return frappe._dict(valuation_rate=valuation_rate, value_change=-value_change, fifo_queue=fifo.to_json(),
+						qty_after_transaction=qty_after_transaction,
+						stock_value_after_transaction=stock_value_after_transaction)
+
+
+def get_transfer_rate(source_value_change: float, qty: int) -> float:
+	# Cost per unit of qty moved out of the source warehouse of a transfer, the rate it arrives at in the target
+	return -source_value_change / qty
+
+
+class ValuationContext:
+	# Valuation state of the bins touched by one submit or cancel
+	# Stock Settings and the bins are read once up front, every ledger row is applied to the bins in memory so that
+	# later rows of the same bin see earlier ones, and each bin is written once by flush
+
+	def __init__(self, pairs: list, for_update: bool = False):
+		# for_update locks the bins until the transaction ends, see lock_bins
+		self.valuation_method = frappe.db.get_single_value("Stock Settings", "valuation_method")
+		self.bins = lock_bins(pairs) if for_update else get_bins_details(pairs)
+		self.changes = {}
+
+	def apply(self, item: str, warehouse: str, qty_change: int, rate: float,
+			  is_consumed: bool = False) -> frappe._dict:
+		# Value a ledger row against the bin, as value_stock_change
+		valuation = value_stock_change(self.bins[(item, warehouse)], qty_change, rate, self.valuation_method,
+									   is_consumed)
+		self._update_bin(item, warehouse, qty_change, valuation)
+		return valuation
+
+	def reverse(self, item: str, warehouse: str, qty_change: int, value_change: float,
+				in_out_rate: float) -> frappe._dict:
+		# Undo a ledger row of qty_change and value_change, as reverse_stock_change
+		valuation = reverse_stock_change(self.bins[(item, warehouse)], qty_change, value_change, in_out_rate,
+										 self.valuation_method)
+		self._update_bin(item, warehouse, -qty_change, valuation)
+		return valuation
+
+	def flush(self):
+		# Write the net change of every touched bin with one update per bin
+		for (item, warehouse), (qty_change, value_change) in self.changes.items():
+			bin_details = self.bins[(item, warehouse)]
+			update_bin(item, warehouse, qty_change, value_change, bin_details.valuation_rate, bin_details.fifo_queue,
+					   bin_details.name)
+		self.changes = {}
+
+	def _update_bin(self, item: str, warehouse: str, qty_change: int, valuation: frappe._dict):
+		self.bins[(item, warehouse)].update(actual_qty=valuation.qty_after_transaction,
+											stock_value=valuation.stock_value_after_transaction,
+											valuation_rate=valuation.valuation_rate, fifo_queue=valuation.fifo_queue)
+		change = self.changes.setdefault((item, warehouse), [0, 0])
+		change[0] += qty_change
+		change[1] += valuation.value_change
@@ -0,0 +1,7 @@
+from inventory_management.inventory_management.doctype.stock_ledger_entry.stock_ledger_entry import \
+	on_doctype_update
+
+
+def execute():
+	# Existing sites don't re-sync Stock Ledger Entry, so add its indexes explicitly
+	on_doctype_update()
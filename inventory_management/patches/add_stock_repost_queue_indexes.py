@@ -0,0 +1,7 @@
+from inventory_management.inventory_management.doctype.stock_repost_queue.stock_repost_queue import \
+	on_doctype_update
+
+
+def execute():
+	# Existing sites don't re-sync Stock Repost Queue, so add its indexes explicitly
+	on_doctype_update()
@@ -0,0 +1,36 @@
+import frappe
+from frappe.query_builder import functions as fn
+from pypika import Order
+
+
+def execute():
+	# Build a bin for every (item, warehouse) pair already present in the stock ledger
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	balances = (frappe.qb.from_(doctype)
+				.select(doctype.item, doctype.warehouse,
+						fn.Sum(doctype.qty_change).as_("actual_qty"),
+						fn.Sum(doctype.qty_change * doctype.in_out_rate).as_("stock_value"))
+				.groupby(doctype.item, doctype.warehouse)
+				.run(as_dict=True))
+
+	for balance in balances:
+		if frappe.db.exists("Bin", {"item": balance.item, "warehouse": balance.warehouse}):
+			continue
+		valuation_rate = (frappe.qb.from_(doctype)
+						  .select(doctype.valuation_rate)
+						  .where(doctype.item == balance.item)
+						  .where(doctype.warehouse == balance.warehouse)
+						  .orderby(doctype.posting_date, order=Order.desc)
+						  .orderby(doctype.posting_time, order=Order.desc)
+						  .limit(1)
+						  .run())
+		bin_doc = frappe.get_doc({
+			"doctype": "Bin",
+			"item": balance.item,
+			"warehouse": balance.warehouse,
+			"actual_qty": balance.actual_qty or 0,
+			"stock_value": balance.stock_value or 0,
+			"valuation_rate": valuation_rate[0][0] if valuation_rate else 0
+		})
+		bin_doc.flags.ignore_permissions = True
+		bin_doc.insert()
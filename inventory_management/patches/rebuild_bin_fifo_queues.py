@@ -0,0 +1,29 @@
+import frappe
+
+from inventory_management.inventory_management.valuation import FIFOValuation
+
+
+def execute():
+	# Replay the stock ledger of every bin in posting order to build its FIFO queue
+	valuation_method = frappe.get_doc("Stock Settings").valuation_method
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	for bin_details in frappe.get_all("Bin", fields=["name", "item", "warehouse"]):
+		entries = (frappe.qb.from_(doctype)
+				   .select(doctype.qty_change, doctype.in_out_rate)
+				   .where(doctype.item == bin_details.item)
+				   .where(doctype.warehouse == bin_details.warehouse)
+				   .orderby(doctype.posting_date)
+				   .orderby(doctype.posting_time)
+				   .orderby(doctype.creation)
+				   .run(as_dict=True))
+		fifo = FIFOValuation()
+		for entry in entries:
+			if entry.qty_change > 0:
+				fifo.add_stock(entry.qty_change, entry.in_out_rate)
+			elif entry.qty_change < 0:
+				fifo.remove_stock(-entry.qty_change)
+
+		values = {"fifo_queue": fifo.to_json()}
+		if valuation_method == "FIFO":
+			values.update({"stock_value": fifo.value, "valuation_rate": fifo.valuation_rate})
+		frappe.db.set_value("Bin", bin_details.name, values, update_modified=False)
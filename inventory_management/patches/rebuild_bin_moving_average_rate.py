@@ -0,0 +1,29 @@
+import frappe
+
+
+def execute():
+	# Replay the stock ledger of every bin in posting order to rebuild its moving average rate
+	if frappe.get_doc("Stock Settings").valuation_method != "Moving Average":
+		return
+
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	for bin_details in frappe.get_all("Bin", fields=["name", "item", "warehouse"]):
+		entries = (frappe.qb.from_(doctype)
+				   .select(doctype.qty_change, doctype.in_out_rate)
+				   .where(doctype.item == bin_details.item)
+				   .where(doctype.warehouse == bin_details.warehouse)
+				   .orderby(doctype.posting_date)
+				   .orderby(doctype.posting_time)
+				   .orderby(doctype.creation)
+				   .run(as_dict=True))
+		qty, valuation_rate = 0, 0
+		for entry in entries:
+			if entry.qty_change > 0:
+				if qty > 0:
+					valuation_rate = (qty * valuation_rate + entry.qty_change * entry.in_out_rate) / (qty + entry.qty_change)
+				else:
+					valuation_rate = entry.in_out_rate
+			qty += entry.qty_change
+
+		frappe.db.set_value("Bin", bin_details.name, {"stock_value": qty * valuation_rate,
+													  "valuation_rate": valuation_rate}, update_modified=False)
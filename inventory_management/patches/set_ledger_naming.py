@@ -0,0 +1,12 @@
+import frappe
+
+
+def execute():
+	# Stock Entries and ledger entries named from now on get time ordered names, existing names are kept as they are
+	# Time ordered names sort after every series name, so name still orders entries posted at the same date and
+	# time the way they were made
+	# Switching back to Series is not undone that way, series names made after it sort before the time ordered
+	# names, entries posted at the same date and time as such an entry are then taken after it in reposts,
+	# cancels and paging
+	if not frappe.db.get_single_value("Stock Settings", "ledger_naming"):
+		frappe.db.set_single_value("Stock Settings", "ledger_naming", "Time Ordered")
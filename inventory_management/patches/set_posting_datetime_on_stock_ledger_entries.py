@@ -0,0 +1,18 @@
+import frappe
+
+from inventory_management.inventory_management.doctype.stock_ledger_entry.stock_ledger_entry import \
+	on_doctype_update
+
+
+def execute():
+	# Fill the combined posting datetime of existing entries in a single statement
+	frappe.db.sql("""
+		UPDATE `tabStock Ledger Entry`
+		SET posting_datetime = TIMESTAMP(posting_date, posting_time)
+		WHERE posting_datetime IS NULL
+	""")
+
+	# Every query now goes through posting_datetime, the separate date and time indexes only slow down writes
+	for index_name in ("item_warehouse_posting_index", "posting_index"):
+		frappe.db.sql("ALTER TABLE `tabStock Ledger Entry` DROP INDEX IF EXISTS `{}`".format(index_name))
+	on_doctype_update()
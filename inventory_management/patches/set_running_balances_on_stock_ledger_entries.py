@@ -0,0 +1,27 @@
+import frappe
+
+
+def execute():
+	# Walk the stock ledger of every bin in posting order and store running balances on each entry
+	doctype = frappe.qb.DocType("Stock Ledger Entry")
+	for bin_details in frappe.get_all("Bin", fields=["item", "warehouse"]):
+		entries = (frappe.qb.from_(doctype)
+				   .select(doctype.name, doctype.qty_change, doctype.valuation_rate)
+				   .where(doctype.item == bin_details.item)
+				   .where(doctype.warehouse == bin_details.warehouse)
+				   .orderby(doctype.posting_date)
+				   .orderby(doctype.posting_time)
+				   .orderby(doctype.creation)
+				   .run(as_dict=True))
+		qty_after_transaction, stock_value_after_transaction = 0, 0
+		updates = {}
+		for entry in entries:
+			qty_after_transaction += entry.qty_change
+			stock_value = qty_after_transaction * (entry.valuation_rate or 0)
+			updates[entry.name] = {
+				"qty_after_transaction": qty_after_transaction,
+				"stock_value_after_transaction": stock_value,
+				"stock_value_difference": stock_value - stock_value_after_transaction
+			}
+			stock_value_after_transaction = stock_value
+		frappe.db.bulk_update("Stock Ledger Entry", updates, update_modified=False)